@@ -0,0 +1,220 @@
+# Copyright © 2022 Doug Jones
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+# times the stages of track shape generation in trackshape.py
+# usage: python3 benchmark.py [-n *repeat*] [--save *file*]
+#         [--baseline *file*] [*shape.json*...]
+# runs without blender, like trackshape.py does for shapes without a
+# switch stand, so it needs the python mathutils and numpy modules
+#
+# by default the sample shapes in this directory are used with
+# ustracks.json, plus synthetic stress shapes
+# the time of each stage excludes the time of the other stages it calls
+# the best time of the repeated runs is reported
+
+import argparse
+import copy
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+
+scriptdir= os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0,scriptdir)
+import trackshape
+import trackprofile
+
+stages= [ "getCenterLine", "makeSwitchPartLines", "makeCrossingPartLines",
+ "makeMesh", "writeTrack" ]
+
+sampleShapes= [ "switch06l.json", "switch06ld.json", "switch06ls.json",
+ "switch06lx.json", "switch06r.json", "switch06rd.json", "switch06rs.json",
+ "switch06rx.json", "crossing5.json", "crossing11.json", "crossing20.json",
+ "crossing30.json", "crossing45.json", "crossing60.json", "crossing90.json",
+ "derail.json", "tunnel1.json", "tunnel2.json" ]
+
+# returns a crossing shape for two straight paths of length l that cross
+# at their middles at angle degrees
+def crossingShape(name,angle,l):
+    a= math.radians(angle)
+    return { "filename": name+".s", "guardRailLengths": [ 1, 3, 2.5 ],
+     "paths": [
+      { "start": [ 0, 0, 0 ], "angle": 0, "moves": [ [ l, 0 ] ] },
+      { "start": [ l/2*math.sin(a), 0, l/2*(1-math.cos(a)) ],
+       "angle": -angle, "moves": [ [ l, 0 ] ] } ] }
+
+# returns the synthetic stress shapes and their profile files
+def stressShapes():
+    return [
+     ("bridge2km",{ "filename": "bridge2km.s",
+      "paths": [ { "start": [ 0, 0, 0 ], "angle": 0,
+       "moves": [ [ 400, 0 ], [ 1000, 34.4 ], [ 200, 0 ],
+        [ 1000, -34.4 ], [ 200, 0 ] ] } ] },"ballastdeck.json"),
+     ("bridge2kmchunked",{ "filename": "bridge2kmchunked.s",
+      "chunkLength": 200,
+      "paths": [ { "start": [ 0, 0, 0 ], "angle": 0,
+       "moves": [ [ 400, 0 ], [ 1000, 34.4 ], [ 200, 0 ],
+        [ 1000, -34.4 ], [ 200, 0 ] ] } ] },"ballastdeck.json"),
+     ("crossing1",crossingShape("crossing1",1,400),"ustracks.json"),
+     ("crossing2",crossingShape("crossing2",2,200),"ustracks.json"),
+     ("segments",{ "filename": "segments.s",
+      "paths": [ { "start": [ 0, 0, 0 ], "angle": 0,
+       "moves": [ [ 300, 90, 2000 ], [ 300, -90, 2000 ] ] } ] },
+      "ustracks.json")
+    ]
+
+# accumulated time for each stage
+stageTimes= {}
+# time spent in nested stages for each active stage
+stageStack= []
+
+# returns a function that calls func and adds its time to stageTimes
+def timeStage(name,func):
+    def timed(*args,**kw):
+        stageStack.append(0)
+        t0= time.perf_counter()
+        try:
+            return func(*args,**kw)
+        finally:
+            t= time.perf_counter()-t0
+            nested= stageStack.pop()
+            stageTimes[name]= stageTimes.get(name,0)+t-nested
+            if stageStack:
+                stageStack[-1]+= t
+    return timed
+
+for stage in stages:
+    setattr(trackshape,stage,timeStage(stage,getattr(trackshape,stage)))
+
+# returns the number of vertices and triangles in each LOD of the profile
+# made by makeTrack
+def lodCounts(profile):
+    counts= {}
+    for lod in profile["LODs"]:
+        if not lod["meshes"]:
+            continue
+        nverts= 0
+        ntris= 0
+        for meshData in lod["meshes"]:
+            nverts+= len(meshData["coords"])
+            ntris+= int((meshData["loopTotals"]-2).sum())
+        counts["%d %s"%(lod["CutoffRadius"],lod["Name"])]= [ nverts, ntris ]
+    return counts
+
+# makes a shape repeat times and returns the best time for each stage
+# and the LOD counts
+def runShape(shape,profile,repeat,tmpdir):
+    best= None
+    for i in range(repeat):
+        s= copy.deepcopy(shape)
+        s["filename"]= os.path.join(tmpdir,os.path.basename(s["filename"]))
+        trackshape.profile= profile
+        stageTimes.clear()
+        t0= time.perf_counter()
+        trackshape.makeTrack(s,profile,None)
+        trackshape.writeTrack(s,profile)
+        stageTimes["total"]= time.perf_counter()-t0
+        if best is None:
+            best= dict(stageTimes)
+        else:
+            for k,t in stageTimes.items():
+                best[k]= min(best.get(k,t),t)
+    return { "times": best, "lods": lodCounts(profile) }
+
+def printResult(name,result):
+    times= result["times"]
+    print("%-16s %s"%(name," ".join("%s %.1fms"%(stage,times[stage]*1000)
+     for stage in stages+["total"] if stage in times)))
+    for lod,(nverts,ntris) in result["lods"].items():
+        print("    %-24s %7d verts %7d tris"%(lod,nverts,ntris))
+
+# compares results with a baseline
+# returns the number of stage times more than tolerance slower
+def compare(results,baseline,tolerance):
+    nslower= 0
+    for name,result in results.items():
+        if name not in baseline:
+            continue
+        base= baseline[name]
+        for stage,t in result["times"].items():
+            t0= base["times"].get(stage)
+            if t0 is None:
+                continue
+            if t > t0*(1+tolerance) and t-t0 > .001:
+                print("SLOWER %s %s %.1fms was %.1fms"%(name,stage,
+                 t*1000,t0*1000))
+                nslower+= 1
+            elif t < t0*(1-tolerance) and t0-t > .001:
+                print("faster %s %s %.1fms was %.1fms"%(name,stage,
+                 t*1000,t0*1000))
+        if result["lods"] != base["lods"]:
+            print("changed %s LOD counts"%(name))
+            for lod in sorted(set(result["lods"])|set(base["lods"])):
+                if result["lods"].get(lod) != base["lods"].get(lod):
+                    print("    %s %s was %s"%(lod,result["lods"].get(lod),
+                     base["lods"].get(lod)))
+    return nslower
+
+def main():
+    parser= argparse.ArgumentParser(
+     description="time the stages of track shape generation")
+    parser.add_argument("shapes",nargs="*",
+     help="shape files (default sample and stress shapes)")
+    parser.add_argument("--profile",default="ustracks.json",
+     help="profile for shape files")
+    parser.add_argument("-n","--repeat",type=int,default=3,
+     help="number of times to make each shape")
+    parser.add_argument("--save",help="save results as a baseline file")
+    parser.add_argument("--baseline",help="compare with a baseline file")
+    parser.add_argument("--tolerance",type=float,default=.25,
+     help="fraction slower than baseline reported as a regression")
+    args= parser.parse_args()
+    jobs= []
+    if args.shapes:
+        for f in args.shapes:
+            jobs.append((os.path.basename(f),trackshape.readjson(f),
+             args.profile))
+    else:
+        for f in sampleShapes:
+            jobs.append((f,trackshape.readjson(os.path.join(scriptdir,f)),
+             os.path.join(scriptdir,"ustracks.json")))
+        for name,shape,profile in stressShapes():
+            jobs.append((name,shape,os.path.join(scriptdir,profile)))
+    profiles= {}
+    results= {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name,shape,profilefile in jobs:
+            if profilefile not in profiles:
+                profiles[profilefile]= trackprofile.loadProfile(profilefile)
+            results[name]= runShape(shape,profiles[profilefile],
+             args.repeat,tmpdir)
+            printResult(name,results[name])
+    if args.save:
+        with open(args.save,"w") as fd:
+            json.dump(results,fd,indent=1,sort_keys=True)
+    if args.baseline:
+        baseline= trackshape.readjson(args.baseline)
+        if compare(results,baseline,args.tolerance):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
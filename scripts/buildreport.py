@@ -0,0 +1,131 @@
+# Copyright © 2022 Doug Jones
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+# optional timing report for trackshape.py and tobj2s.py
+#
+# the report is turned on with --report *file.json* after -- on the
+# blender command line or by setting the BUILDREPORT environment variable
+# to the report file name
+# it records the wall time and memory growth of each stage of making each
+# shape or tile, and the size of the output files
+# buildshapes.py --report collects the reports of all of its jobs
+#
+# report format:
+#  script: name of the script
+#  started: time the script started, to find blender startup time
+#  items: list of shapes or tiles, each with:
+#   name: shape or tile file name
+#   stages: dictionary of stage name to time (seconds), calls and
+#    memoryIncrease, the largest rise (MB) in the peak memory of the
+#    process during one call of the stage
+#    the peak never goes down, so a stage that only reuses memory freed
+#    by an earlier one shows no rise
+#   outputs: dictionary of output file name to size in bytes
+#   failed: True if the item could not be made
+#  time: total time in seconds
+#  peakMemory: peak memory of the whole process in MB
+
+import atexit
+import contextlib
+import json
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource= None
+
+filename= None
+report= None
+current= None
+
+# returns the peak memory used by this process in MB or None if unknown
+def peakMemory():
+    if resource is None:
+        return None
+    rss= resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return rss/(1024*1024)
+    return rss/1024
+
+# turns on the report if args starts with --report or BUILDREPORT is set
+# returns args without the --report option
+def enable(script,args):
+    global filename,report
+    if args and args[0] == "--report":
+        filename= args[1]
+        args= args[2:]
+    elif os.environ.get("BUILDREPORT"):
+        filename= os.environ["BUILDREPORT"]
+    if filename and report is None:
+        report= { "script": script, "started": time.time(), "items": [] }
+        atexit.register(write)
+    return args
+
+# starts recording stages for a shape or tile
+def item(name):
+    global current
+    if report is None:
+        return
+    current= { "name": name, "stages": {}, "outputs": {} }
+    report["items"].append(current)
+
+# records the time and memory of a stage of the current item
+@contextlib.contextmanager
+def stage(name):
+    if report is None:
+        yield
+        return
+    if current is None:
+        item("")
+    t0= time.time()
+    m0= peakMemory()
+    try:
+        yield
+    finally:
+        s= current["stages"].setdefault(name,
+         { "time": 0, "calls": 0, "memoryIncrease": None })
+        s["time"]+= time.time()-t0
+        s["calls"]+= 1
+        if m0 is not None:
+            s["memoryIncrease"]= max(s["memoryIncrease"] or 0,
+             peakMemory()-m0)
+
+# records the size of an output file of the current item
+def output(filename):
+    if report is None or current is None:
+        return
+    if os.path.exists(filename):
+        current["outputs"][filename]= os.path.getsize(filename)
+
+# records that the current item could not be made
+def failed():
+    if report is not None and current is not None:
+        current["failed"]= True
+
+def write():
+    if report is None:
+        return
+    report["time"]= time.time()-report["started"]
+    report["peakMemory"]= peakMemory()
+    with open(filename,"w") as fd:
+        json.dump(report,fd,indent=1)
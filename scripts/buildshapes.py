@@ -0,0 +1,517 @@
+# Copyright © 2022 Doug Jones
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+# builds track shape and terrain patch .s files using several blender
+# processes at once, replaces makebrdgtrack and makepatchmodels
+# usage: python3 buildshapes.py [-j *jobs*] [-f] [shapes] [patches]
+# must be run in the route directory that contains SHAPES and TILES
+# only outputs whose inputs have changed since the last build are made,
+# see buildmanifest.json
+
+import argparse
+import concurrent.futures
+import glob
+import hashlib
+import json
+import math
+import os
+import queue
+import subprocess
+import sys
+import tempfile
+import time
+
+scriptdir= os.path.dirname(os.path.abspath(__file__))
+
+# start of the line buildworker.py writes when it finishes a job
+workerResultTag= "@buildworker "
+
+# shape file patterns in SHAPES, the profile used for each and
+# whether or not the .s files are compressed
+shapeGroups= [
+    ("brdgtrackbd*.json","ballastdeck.json",False),
+    ("brdgtracktd*.json","bridgerails.json",True),
+    ("switchext*.json","ustracks.json",True)
+]
+
+def readjson(filename):
+    fd= open(filename,'r')
+    return json.load(fd)
+
+# returns the name of the .s file made by tobj2s.py for a patch .obj file
+def patchShapeFile(objfile):
+    fname= os.path.basename(objfile)[:-4]
+    return os.path.join("SHAPES","t"+fname+".s")
+
+# returns the name of the .s file made by trackshape.py for a shape file
+def trackShapeFile(shapefile):
+    shape= readjson(shapefile)
+    return os.path.join(os.path.dirname(shapefile),shape["filename"])
+
+# returns True if filename exists and was modified after time t
+def madeSince(filename,t):
+    return os.path.exists(filename) and os.path.getmtime(filename) >= t
+
+# splits a list into about n lists with at most size items each
+def splitList(items,n,size):
+    m= max(1,min(size,int(math.ceil(len(items)/n))))
+    return [ items[i:i+m] for i in range(0,len(items),m) ]
+
+# name of the file in the route directory that records a hash of the
+# inputs used to make each output file
+manifestFile= "buildmanifest.json"
+
+# reads the build manifest
+# "files" holds the modification time, size and hash of each input file
+# so unchanged files are not read again
+# "outputs" holds the hash of the inputs of each output file
+def readManifest(filename):
+    manifest= { "files": {}, "outputs": {} }
+    if os.path.exists(filename):
+        try:
+            manifest.update(readjson(filename))
+        except ValueError:
+            print("ignoring bad manifest %s"%(filename))
+    return manifest
+
+def writeManifest(manifest,filename):
+    with open(filename,"w") as fd:
+        json.dump(manifest,fd,indent=1,sort_keys=True)
+
+# returns the hash of a file's contents, or "" if it does not exist
+def fileHash(manifest,filename):
+    try:
+        st= os.stat(filename)
+    except OSError:
+        return ""
+    entry= manifest["files"].get(filename)
+    if entry and entry[0]==st.st_mtime and entry[1]==st.st_size:
+        return entry[2]
+    with open(filename,"rb") as fd:
+        h= hashlib.sha1(fd.read()).hexdigest()
+    manifest["files"][filename]= [ st.st_mtime, st.st_size, h ]
+    return h
+
+# returns a hash of all of an output's input files and options
+def inputHash(manifest,inputs,options):
+    h= hashlib.sha1(json.dumps(options).encode())
+    for filename in inputs:
+        h.update(filename.encode())
+        h.update(fileHash(manifest,filename).encode())
+    return h.hexdigest()
+
+# returns True if output must be made from inputs
+# an existing output that is not in the manifest but is newer than all of
+# its inputs is assumed to be up to date, as with the old mtime checks
+def needsBuild(manifest,output,inputs,h,force):
+    if force or not os.path.exists(output):
+        return True
+    if output in manifest["outputs"]:
+        return manifest["outputs"][output] != h
+    t= os.path.getmtime(output)
+    for filename in inputs:
+        if not os.path.exists(filename) or os.path.getmtime(filename) > t:
+            return True
+    manifest["outputs"][output]= h
+    return False
+
+# returns the input files used by trackshape.py to make a shape
+# these include the shape files a mirrored shape is made from
+def shapeInputs(shapefile,shape,profile):
+    inputs= [ shapefile, profile ]
+    for f in ("trackshape.py","shapewriter.py","trackprofile.py",
+     "schemacheck.py","buildreport.py","profile.schema.json"):
+        inputs.append(os.path.join(scriptdir,f))
+    if "switchstand" in shape:
+        inputs.append(os.path.join(os.path.dirname(shapefile),
+         shape["switchstand"]["file"]))
+    while "mirror" in shape:
+        shapefile= os.path.join(os.path.dirname(shapefile),shape["mirror"])
+        if shapefile in inputs:
+            break
+        inputs.append(shapefile)
+        shape= readjson(shapefile)
+    return inputs
+
+# returns the option that makes trackshape.py or tobj2s.py write
+# compressed .s files, unless they are compressed with compressshape
+def compressArgs(compress,compressshape):
+    if compress and not compressshape:
+        return [ "--compress" ]
+    return []
+
+# returns the command that runs a script in a new blender process
+def blenderCommand(blender,script,args):
+    return [ blender, "-b", "--python", os.path.join(scriptdir,script),
+     "--" ] + args
+
+# finds the track shape jobs for shapes whose inputs have changed
+# each job makes several shapes with the same profile in one blender session
+# with text the .s files are left uncompressed
+def findShapeJobs(blender,nworkers,batch,manifest,force,compressshape,text):
+    jobs= []
+    for pattern,profile,compress in shapeGroups:
+        compress= compress and not text
+        shapefiles= []
+        hashes= {}
+        for f in sorted(glob.glob(os.path.join("SHAPES",pattern))):
+            shape= readjson(f)
+            output= os.path.join(os.path.dirname(f),shape["filename"])
+            inputs= shapeInputs(f,shape,profile)
+            h= inputHash(manifest,inputs,{"compress":compress})
+            if needsBuild(manifest,output,inputs,h,force):
+                shapefiles.append(f)
+                hashes[output]= h
+        for files in splitList(shapefiles,nworkers,batch):
+            args= compressArgs(compress,compressshape)
+            args+= [ os.path.basename(f) for f in files ]
+            args.append(os.path.join(os.path.abspath("."),profile))
+            outputs= [ trackShapeFile(f) for f in files ]
+            jobs.append({ "name": "%s (%d shapes)"%(files[0],len(files)),
+             "script": "trackshape.py", "args": args,
+             "cmd": blenderCommand(blender,"trackshape.py",args),
+             "cwd": "SHAPES", "outputs": outputs, "compress": compress,
+             "hashes": { f: hashes[f] for f in outputs } })
+    return jobs
+
+# optional file in the route directory that changes the distance levels
+# and decimation ratios used by tobj2s.py
+patchLODFile= "patchlods.json"
+
+# optional file in the route directory that turns on the tobj2s.py
+# texture atlas
+patchAtlasFile= "patchatlas.json"
+
+# finds the terrain patch jobs for .obj files whose inputs have changed
+def findPatchJobs(blender,manifest,force,compressshape,text):
+    jobs= []
+    compress= not text
+    for objfile in sorted(glob.glob(os.path.join("TILES","*.obj"))):
+        sfile= patchShapeFile(objfile)
+        inputs= [ objfile, os.path.join(scriptdir,"tobj2s.py"),
+         os.path.join(scriptdir,"buildreport.py"),
+         os.path.join(scriptdir,"shapewriter.py") ]
+        args= compressArgs(compress,compressshape)
+        if os.path.exists(patchLODFile):
+            inputs.append(patchLODFile)
+            args+= [ "--lods", patchLODFile ]
+        if os.path.exists(patchAtlasFile):
+            inputs.append(patchAtlasFile)
+            args+= [ "--atlas", patchAtlasFile ]
+        args.append(objfile)
+        h= inputHash(manifest,inputs,{"compress":compress})
+        if not needsBuild(manifest,sfile,inputs,h,force):
+            continue
+        jobs.append({ "name": objfile, "script": "tobj2s.py", "args": args,
+         "cmd": blenderCommand(blender,"tobj2s.py",args), "cwd": ".",
+         "outputs": [ sfile ], "compress": compress, "hashes": { sfile: h } })
+    return jobs
+
+# records the input hashes of the outputs that were made
+def updateManifest(manifest,jobs):
+    for job in jobs:
+        for f in job["outputs"]:
+            if f in job.get("failed",job["outputs"]):
+                manifest["outputs"].pop(f,None)
+            else:
+                manifest["outputs"][f]= job["hashes"][f]
+
+# starts a blender process that runs buildworker.py
+def startWorker(blender):
+    return subprocess.Popen([ blender, "-b", "--python",
+     os.path.join(scriptdir,"buildworker.py") ],
+     stdin=subprocess.PIPE,stdout=subprocess.PIPE,stderr=subprocess.STDOUT,
+     universal_newlines=True,bufsize=1)
+
+# starts n warm blender workers
+# returns a dictionary with the blender program and a queue of idle workers
+def startWorkers(blender,n):
+    workers= { "blender": blender, "idle": queue.Queue() }
+    for i in range(n):
+        workers["idle"].put(startWorker(blender))
+    return workers
+
+def stopWorkers(workers):
+    while not workers["idle"].empty():
+        proc= workers["idle"].get()
+        try:
+            proc.stdin.close()
+            proc.wait(10)
+        except (OSError,subprocess.TimeoutExpired):
+            proc.kill()
+
+# runs a job on an idle warm worker and returns its output
+# a worker that exits is replaced by a new one
+def runOnWorker(workers,job):
+    proc= workers["idle"].get()
+    log= []
+    try:
+        proc.stdin.write(json.dumps({ "script": job["script"],
+         "cwd": os.path.abspath(job["cwd"]), "args": job["args"] })+"\n")
+        proc.stdin.flush()
+        for line in proc.stdout:
+            if line.startswith(workerResultTag):
+                break
+            log.append(line)
+        else:
+            log.append("blender worker exited\n")
+    except OSError as e:
+        log.append("blender worker failed: %s\n"%(e))
+    finally:
+        if proc.poll() is not None:
+            proc= startWorker(workers["blender"])
+        workers["idle"].put(proc)
+    return "".join(log)
+
+# runs one job and compresses its output files with compressshape if given
+# the job runs on a warm worker if workers is given, otherwise in a new
+# blender process
+# returns the job with its results added
+def runJob(job,compressshape,workers=None):
+    t0= time.time()
+    job["started"]= t0
+    env= None
+    if "report" in job:
+        env= dict(os.environ,BUILDREPORT=job["report"])
+    if workers:
+        job["log"]= runOnWorker(workers,job)
+    else:
+        try:
+            proc= subprocess.run(job["cmd"],cwd=job["cwd"],env=env,
+             stdout=subprocess.PIPE,stderr=subprocess.STDOUT,
+             universal_newlines=True)
+            job["log"]= proc.stdout
+        except OSError as e:
+            job["log"]= str(e)
+    job["failed"]= [ f for f in job["outputs"] if not madeSince(f,t0) ]
+    if compressshape:
+        for f in job["outputs"]:
+            if f in job["failed"] or not job["compress"]:
+                continue
+            try:
+                cproc= subprocess.run([compressshape,f],
+                 stdout=subprocess.PIPE,stderr=subprocess.STDOUT,
+                 universal_newlines=True)
+                job["log"]+= cproc.stdout
+                if cproc.returncode != 0:
+                    job["failed"].append(f)
+            except OSError as e:
+                job["log"]+= str(e)
+                job["failed"].append(f)
+    job["time"]= time.time()-t0
+    return job
+
+# collects the buildreport.py reports written by the jobs into one
+# report for the whole build, with the total time, calls and largest
+# memory increase of each stage, and the blender startup time and process
+# peak memory of each job
+def writeReport(jobs,filename,t):
+    stages= {}
+    outputs= {}
+    jobReports= []
+    for job in jobs:
+        jr= { "name": job["name"], "time": job.get("time"),
+         "failed": job.get("failed",[]) }
+        try:
+            report= readjson(job["report"])
+        except (OSError,ValueError):
+            report= None
+        if report:
+            jr["startup"]= report["started"]-job["started"]
+            jr["peakMemory"]= report["peakMemory"]
+            jr["items"]= report["items"]
+            startup= stages.setdefault("startup",
+             { "time": 0, "calls": 0, "memoryIncrease": None })
+            startup["time"]+= jr["startup"]
+            startup["calls"]+= 1
+            for item in report["items"]:
+                for name,st in item["stages"].items():
+                    total= stages.setdefault(name,
+                     { "time": 0, "calls": 0, "memoryIncrease": None })
+                    total["time"]+= st["time"]
+                    total["calls"]+= st["calls"]
+                    if st["memoryIncrease"] is not None:
+                        total["memoryIncrease"]= max(
+                         total["memoryIncrease"] or 0,st["memoryIncrease"])
+                for f,size in item["outputs"].items():
+                    outputs[os.path.normpath(os.path.join(job["cwd"],f))]= size
+        jobReports.append(jr)
+    with open(filename,"w") as fd:
+        json.dump({ "time": t, "stages": stages, "outputs": outputs,
+         "outputBytes": sum(outputs.values()), "jobs": jobReports },
+         fd,indent=1)
+    for name,st in sorted(stages.items(),key=lambda x: -x[1]["time"]):
+        print("%-16s %8.1fs %6d calls"%(name,st["time"],st["calls"]))
+
+# runs all jobs using nworkers processes at once
+# returns the list of output files that could not be made
+def runJobs(jobs,nworkers,compressshape,verbose,workers=None):
+    failed= []
+    with concurrent.futures.ThreadPoolExecutor(nworkers) as executor:
+        futures= [ executor.submit(runJob,job,compressshape,workers)
+         for job in jobs ]
+        for future in concurrent.futures.as_completed(futures):
+            job= future.result()
+            if job["failed"]:
+                print("FAILED %s %.1fs"%(job["name"],job["time"]))
+                for f in job["failed"]:
+                    print("  cannot make %s"%(f))
+                print(job["log"])
+                failed+= job["failed"]
+            else:
+                print("ok %s %.1fs"%(job["name"],job["time"]))
+                if verbose:
+                    print(job["log"])
+    return failed
+
+# finds the jobs for outputs whose inputs have changed
+def findJobs(args,targets,manifest):
+    jobs= []
+    if "shapes" in targets:
+        jobs+= findShapeJobs(args.blender,args.jobs,args.batch,manifest,
+         args.force,args.compressshape,args.text)
+    if "patches" in targets:
+        jobs+= findPatchJobs(args.blender,manifest,args.force,
+         args.compressshape,args.text)
+    return jobs
+
+# returns the modification time and size of the files watch mode checks
+def watchedFiles():
+    files= {}
+    patterns= [ os.path.join("SHAPES","*.json"),
+     os.path.join("TILES","*.obj"), patchLODFile, patchAtlasFile,
+     os.path.join(scriptdir,"*.py"), os.path.join(scriptdir,"*.json"),
+     os.path.join(scriptdir,"*.blend") ]
+    patterns+= [ profile for pattern,profile,compress in shapeGroups ]
+    for pattern in patterns:
+        for f in glob.glob(pattern):
+            try:
+                st= os.stat(f)
+                files[f]= (st.st_mtime,st.st_size)
+            except OSError:
+                pass
+    return files
+
+# rebuilds shapes and patches whenever their inputs change, using warm
+# blender workers
+# waits until no files have changed for the debounce time so a save that
+# writes many files is built once
+# the workers are restarted when the scripts change
+# last stays the snapshot taken before a build, so files saved while it
+# runs are built on the next poll
+def watch(args,targets,compressshape,manifest):
+    workers= startWorkers(args.blender,args.jobs)
+    last= None
+    changed= time.time()
+    print("watching for changes, ^C to stop")
+    try:
+        while True:
+            files= watchedFiles()
+            if files != last:
+                if last is not None:
+                    scripts= [ f for f in set(files)|set(last)
+                     if f.startswith(scriptdir) and
+                     files.get(f) != last.get(f) ]
+                    if scripts:
+                        stopWorkers(workers)
+                        workers= startWorkers(args.blender,args.jobs)
+                last= files
+                changed= time.time()
+            elif changed and time.time()-changed >= args.debounce:
+                changed= None
+                jobs= findJobs(args,targets,manifest)
+                if jobs:
+                    t0= time.time()
+                    failed= runJobs(jobs,args.jobs,compressshape,
+                     args.verbose,workers)
+                    updateManifest(manifest,jobs)
+                    writeManifest(manifest,args.manifest)
+                    print("%d jobs %.1fs %d files failed"%(len(jobs),
+                     time.time()-t0,len(failed)))
+                args.force= False
+            time.sleep(.1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stopWorkers(workers)
+
+def main():
+    parser= argparse.ArgumentParser(
+     description="build track shape and terrain patch .s files")
+    parser.add_argument("targets",nargs="*",
+     help="shapes and/or patches (default both)")
+    parser.add_argument("-j","--jobs",type=int,default=os.cpu_count(),
+     help="number of blender processes to run at once")
+    parser.add_argument("--batch",type=int,default=8,
+     help="maximum number of track shapes per blender process")
+    parser.add_argument("--blender",default="blender",
+     help="blender program")
+    parser.add_argument("--compressshape",default="",
+     help="shape compression program to use instead of writing"
+     " compressed files directly")
+    parser.add_argument("--text",action="store_true",
+     help="leave all .s files uncompressed, for debugging")
+    parser.add_argument("-f","--force",action="store_true",
+     help="make all outputs even if their inputs have not changed")
+    parser.add_argument("--manifest",default=manifestFile,
+     help="build manifest file")
+    parser.add_argument("--report",
+     help="write a json timing and memory report for all jobs")
+    parser.add_argument("-w","--watch",action="store_true",
+     help="keep running and rebuild whenever the inputs change")
+    parser.add_argument("--debounce",type=float,default=.5,
+     help="seconds with no changes before watch mode rebuilds")
+    parser.add_argument("-v","--verbose",action="store_true",
+     help="print blender output for all jobs")
+    args= parser.parse_args()
+    targets= args.targets or ["shapes","patches"]
+    for target in targets:
+        if target not in ["shapes","patches"]:
+            parser.error("unknown target %s"%(target))
+    compressshape= args.compressshape
+    if compressshape:
+        compressshape= os.path.abspath(compressshape)
+    manifest= readManifest(args.manifest)
+    if args.watch:
+        watch(args,targets,compressshape,manifest)
+        return
+    jobs= findJobs(args,targets,manifest)
+    reportdir= None
+    if args.report:
+        reportdir= tempfile.TemporaryDirectory()
+        for i in range(len(jobs)):
+            jobs[i]["report"]= os.path.join(reportdir.name,"job%d.json"%(i))
+    t0= time.time()
+    failed= []
+    try:
+        failed= runJobs(jobs,args.jobs,compressshape,args.verbose)
+    finally:
+        updateManifest(manifest,jobs)
+        writeManifest(manifest,args.manifest)
+    if reportdir:
+        writeReport(jobs,args.report,time.time()-t0)
+        reportdir.cleanup()
+    print("%d jobs %.1fs"%(len(jobs),time.time()-t0))
+    if failed:
+        print("%d files failed"%(len(failed)))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# Copyright © 2022 Doug Jones
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+# keeps blender running to make track shapes and terrain patches for
+# buildshapes.py --watch
+# usage: blender -b --python buildworker.py
+# reads one json job per line from stdin with:
+#  script: trackshape.py or tobj2s.py
+#  cwd: directory to run in
+#  args: the arguments the script would get after --
+# and writes a line starting with resultTag and a json result when done
+
+import bpy
+import json
+import os
+import sys
+import traceback
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+import trackshape
+import tobj2s
+
+resultTag= "@buildworker "
+
+# runs one job in an empty scene
+def runJob(job):
+    bpy.ops.wm.read_homefile()
+    if "Cube" in bpy.data.objects:
+        bpy.data.objects.remove(bpy.data.objects["Cube"])
+    cwd= os.getcwd()
+    os.chdir(job["cwd"])
+    try:
+        args= job["args"]
+        if job["script"] == "tobj2s.py":
+            tobj2s.main(args)
+            return True
+        jobs,compress= trackshape.parseArgs(args)
+        return not trackshape.makeShapes(jobs,compress)
+    finally:
+        os.chdir(cwd)
+
+for line in sys.stdin:
+    try:
+        ok= runJob(json.loads(line))
+    except Exception:
+        traceback.print_exc()
+        ok= False
+    print(resultTag+json.dumps({ "ok": ok }),flush=True)
@@ -0,0 +1,89 @@
+# Copyright © 2022 Doug Jones
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+# checks json data against the subset of JSON schema used by
+# profile.schema.json and shape.schema.json
+# supports type, enum, required, properties, items, minItems, maxItems,
+# minimum and maximum
+
+import json
+import os
+
+schemaTypes= {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "boolean": bool,
+    "number": (int,float),
+    "integer": int
+}
+
+# reads a schema file from the scripts directory
+def readSchema(name):
+    filename= os.path.join(os.path.dirname(os.path.abspath(__file__)),name)
+    with open(filename,"r") as fd:
+        return json.load(fd)
+
+# returns True if value has the schema type t
+def hasType(value,t):
+    if isinstance(t,list):
+        return any(hasType(value,t1) for t1 in t)
+    if t!="boolean" and isinstance(value,bool):
+        return False
+    return isinstance(value,schemaTypes[t])
+
+# returns a list of error messages for data that does not match schema
+# path is used to say where in the data each error is
+def check(data,schema,path="$"):
+    errors= []
+    if "type" in schema and not hasType(data,schema["type"]):
+        return [ "%s: expected %s"%(path,schema["type"]) ]
+    if "enum" in schema and data not in schema["enum"]:
+        errors.append("%s: %s is not one of %s"%(path,
+         json.dumps(data),json.dumps(schema["enum"])))
+    if isinstance(data,dict):
+        for key in schema.get("required",[]):
+            if key not in data:
+                errors.append("%s: missing %s"%(path,key))
+        properties= schema.get("properties",{})
+        for key in data:
+            if key in properties:
+                errors+= check(data[key],properties[key],path+"."+key)
+    if isinstance(data,list):
+        if "minItems" in schema and len(data)<schema["minItems"]:
+            errors.append("%s: fewer than %d items"%(path,schema["minItems"]))
+        if "maxItems" in schema and len(data)>schema["maxItems"]:
+            errors.append("%s: more than %d items"%(path,schema["maxItems"]))
+        if "items" in schema:
+            for i in range(len(data)):
+                errors+= check(data[i],schema["items"],"%s[%d]"%(path,i))
+    if hasType(data,"number"):
+        if "minimum" in schema and data<schema["minimum"]:
+            errors.append("%s: less than %s"%(path,schema["minimum"]))
+        if "maximum" in schema and data>schema["maximum"]:
+            errors.append("%s: greater than %s"%(path,schema["maximum"]))
+    return errors
+
+# raises ValueError if data does not match schema
+def validate(data,schema,name):
+    errors= check(data,schema)
+    if errors:
+        raise ValueError("%s does not match schema:\n  %s"%(name,
+         "\n  ".join(errors)))
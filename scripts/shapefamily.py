@@ -0,0 +1,294 @@
+# Copyright © 2022 Doug Jones
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+# makes a family of switch, derail or crossing shape files from a template
+# and builds them with several blender processes at once, see buildshapes.py
+# usage: python3 shapefamily.py [-j *jobs*] [-o *dir*] [--no-build] *template.json*
+#
+# the template has:
+#  type: switch, derail or crossing
+#  name: python format string for the shape names, using the fields type,
+#   side, angle, frog, radius and length, e.g. "switch{frog:g}{side}"
+#  profile: profile file, relative to the template
+#  angles: list of frog angles in degrees, or
+#  angleRange: [ first, last, step ] in degrees, or
+#  frogs: list of frog numbers
+#  radius: curve radius for switches and derails, one number or a list with
+#   one radius per angle
+#  length: straight path length, one number or one per angle, by default
+#   enough for the curve of a switch or width/sin(angle) up to maxLength
+#   for a crossing
+#  width, maxLength: used for the default crossing length, 4.985 and 50
+#  sides: switch and derail sides to make, "l" and/or "r", default both
+#  mainroute: "straight" or "curved", default straight
+#  switchstand: switch stand for each side, e.g. { "l": {...}, "r": {...} }
+#  shape: other shape file keys added to every shape, e.g. guardRailLengths
+#  compress: false to leave the .s files uncompressed
+#
+# each shape is checked against shape.schema.json and written as a .json
+# file in the output directory, then the shapes that have changed are made
+# an index of the shapes with the end point and heading of each path is
+# written to shapeindex.json in the output directory
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+
+scriptdir= os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0,scriptdir)
+import buildshapes
+import schemacheck
+
+# returns the list of frog angles in degrees and frog numbers given by
+# a template
+def templateAngles(template):
+    if "frogs" in template:
+        frogs= template["frogs"]
+        return [ math.degrees(2*math.atan(1/(2*n))) for n in frogs ],frogs
+    if "angleRange" in template:
+        first,last,step= template["angleRange"]
+        n= int(math.floor((last-first)/step+1e-6))+1
+        angles= [ round(first+i*step,6) for i in range(n) ]
+    else:
+        angles= template["angles"]
+    return angles,[ None for a in angles ]
+
+# returns the i'th value of a template key that is a number or a list
+def templateValue(template,key,i,default=None):
+    value= template.get(key,default)
+    if isinstance(value,list):
+        return value[i]
+    return value
+
+# returns a left switch or derail's paths in left to right order
+def switchPaths(radius,angle,length):
+    return [
+     { "start": [ 0, 0, 0 ], "angle": 0, "moves": [ [ radius, -angle ] ] },
+     { "start": [ 0, 0, 0 ], "angle": 0, "moves": [ [ length, 0 ] ] } ]
+
+# returns a crossing's paths, which cross at their middles
+def crossingPaths(angle,length):
+    a= math.radians(angle)
+    return [
+     { "start": [ 0, 0, 0 ], "angle": 0, "moves": [ [ length, 0 ] ] },
+     { "start": [ round(length/2*math.sin(a),6), 0,
+      round(length/2*(1-math.cos(a)),6) ], "angle": -angle,
+      "moves": [ [ length, 0 ] ] } ]
+
+# returns paths reflected left to right, still in left to right order
+def mirrorPaths(paths):
+    return [ { "start": [ -p["start"][0], p["start"][1], p["start"][2] ],
+     "angle": -p["angle"],
+     "moves": [ [ m[0], -m[1] ]+m[2:] for m in p["moves"] ] }
+     for p in reversed(paths) ]
+
+# returns the shapes described by a template
+# each is a (name, fields, shape) tuple
+def expandTemplate(template):
+    kind= template["type"]
+    angles,frogs= templateAngles(template)
+    shapes= []
+    for i in range(len(angles)):
+        angle= angles[i]
+        fields= { "type": kind, "angle": angle, "frog": frogs[i],
+         "side": "", "radius": None }
+        if kind == "crossing":
+            length= templateValue(template,"length",i)
+            if length is None:
+                length= min(template.get("maxLength",50),
+                 template.get("width",4.985)/math.sin(math.radians(angle)))
+                length= round(length,5)
+            fields["length"]= length
+            shape= { "paths": crossingPaths(angle,length) }
+            shape.update(template.get("shape",{}))
+            name= template["name"].format(**fields)
+            shape["filename"]= name+".s"
+            shapes.append((name,fields,shape))
+            continue
+        radius= templateValue(template,"radius",i)
+        length= templateValue(template,"length",i)
+        if length is None:
+            length= math.ceil(radius*math.sin(math.radians(angle)))
+        fields["radius"]= radius
+        fields["length"]= length
+        curved= template.get("mainroute","straight") == "curved"
+        for side in template.get("sides",[ "l", "r" ]):
+            paths= switchPaths(radius,angle,length)
+            mainroute= 0 if curved else 1
+            if side == "r":
+                paths= mirrorPaths(paths)
+                mainroute= 1-mainroute
+            shape= { "mainroute": mainroute, "paths": paths }
+            if kind == "derail":
+                shape["derail"]= "left" if side == "l" else "right"
+            if side in template.get("switchstand",{}):
+                shape["switchstand"]= template["switchstand"][side]
+            shape.update(template.get("shape",{}))
+            name= template["name"].format(**dict(fields,side=side))
+            shape["filename"]= name+".s"
+            shapes.append((name,dict(fields,side=side),shape))
+    return shapes
+
+# returns the end point, end heading and length of a shape file path
+# headings are in degrees, positive is clockwise, as in the shape file
+def pathEnd(path):
+    x,elevation,y= path["start"]
+    heading= math.radians(path["angle"])
+    length= 0
+    for move in path["moves"]:
+        if move[1] == 0:
+            x+= math.sin(heading)*move[0]
+            y+= math.cos(heading)*move[0]
+            length+= move[0]
+        else:
+            r= move[0]
+            d= math.radians(move[1])
+            sign= 1 if d>0 else -1
+            cx= x + math.cos(heading)*r*sign
+            cy= y - math.sin(heading)*r*sign
+            heading+= d
+            x= cx - math.cos(heading)*r*sign
+            y= cy + math.sin(heading)*r*sign
+            length+= r*abs(d)
+    return { "end": [ round(x,5), elevation, round(y,5) ],
+     "endAngle": round(math.degrees(heading),5), "length": round(length,5) }
+
+# returns the index entry for a generated shape
+def indexEntry(name,fields,shape,failed):
+    entry= dict(fields)
+    entry["file"]= name+".json"
+    entry["filename"]= shape["filename"]
+    entry["paths"]= [ dict(path,**pathEnd(path)) for path in shape["paths"] ]
+    if failed is not None:
+        entry["built"]= shape["filename"] not in failed
+    return entry
+
+# writes the shape files, skipping those that have not changed
+def writeShapes(shapes,outdir):
+    for name,fields,shape in shapes:
+        filename= os.path.join(outdir,name+".json")
+        text= json.dumps(shape,indent=1)+"\n"
+        if os.path.exists(filename):
+            with open(filename,"r") as fd:
+                if fd.read() == text:
+                    continue
+        with open(filename,"w") as fd:
+            fd.write(text)
+
+# makes the .s files whose inputs have changed using buildshapes.py jobs
+# returns the list of .s file names that could not be made
+def buildShapes(shapes,outdir,profile,compress,args):
+    compress= compress and not args.text
+    manifest= buildshapes.readManifest(args.manifest)
+    files= []
+    hashes= {}
+    for name,fields,shape in shapes:
+        f= os.path.join(outdir,name+".json")
+        output= os.path.join(outdir,shape["filename"])
+        inputs= buildshapes.shapeInputs(f,shape,profile)
+        h= buildshapes.inputHash(manifest,inputs,{"compress":compress})
+        if buildshapes.needsBuild(manifest,output,inputs,h,args.force):
+            files.append(f)
+            hashes[output]= h
+    jobs= []
+    for batch in buildshapes.splitList(files,args.jobs,args.batch):
+        jargs= buildshapes.compressArgs(compress,args.compressshape)
+        jargs+= [ os.path.basename(f) for f in batch ]
+        jargs.append(os.path.abspath(profile))
+        outputs= [ buildshapes.trackShapeFile(f) for f in batch ]
+        jobs.append({ "name": "%s (%d shapes)"%(batch[0],len(batch)),
+         "script": "trackshape.py", "args": jargs,
+         "cmd": buildshapes.blenderCommand(args.blender,"trackshape.py",
+          jargs),
+         "cwd": outdir, "outputs": outputs, "compress": compress,
+         "hashes": { f: hashes[f] for f in outputs } })
+    compressshape= args.compressshape
+    if compressshape:
+        compressshape= os.path.abspath(compressshape)
+    t0= time.time()
+    try:
+        failed= buildshapes.runJobs(jobs,args.jobs,compressshape,
+         args.verbose)
+    finally:
+        buildshapes.updateManifest(manifest,jobs)
+        buildshapes.writeManifest(manifest,args.manifest)
+    print("%d jobs %.1fs"%(len(jobs),time.time()-t0))
+    return [ os.path.basename(f) for f in failed ]
+
+def main():
+    parser= argparse.ArgumentParser(
+     description="make a family of track shapes from a template")
+    parser.add_argument("template",help="template .json file")
+    parser.add_argument("-o","--outdir",default=".",
+     help="directory for the shape .json and .s files")
+    parser.add_argument("--index",default="shapeindex.json",
+     help="index file written in the output directory")
+    parser.add_argument("--no-build",dest="build",action="store_false",
+     help="only write the shape .json files and the index")
+    parser.add_argument("-j","--jobs",type=int,default=os.cpu_count(),
+     help="number of blender processes to run at once")
+    parser.add_argument("--batch",type=int,default=8,
+     help="maximum number of track shapes per blender process")
+    parser.add_argument("--blender",default="blender",
+     help="blender program")
+    parser.add_argument("--compressshape",default="",
+     help="shape compression program to use instead of writing"
+     " compressed files directly")
+    parser.add_argument("--text",action="store_true",
+     help="leave the .s files uncompressed, for debugging")
+    parser.add_argument("-f","--force",action="store_true",
+     help="make all shapes even if their inputs have not changed")
+    parser.add_argument("--manifest",default=buildshapes.manifestFile,
+     help="build manifest file")
+    parser.add_argument("-v","--verbose",action="store_true",
+     help="print blender output for all jobs")
+    args= parser.parse_args()
+    template= buildshapes.readjson(args.template)
+    shapes= expandTemplate(template)
+    schema= schemacheck.readSchema("shape.schema.json")
+    try:
+        for name,fields,shape in shapes:
+            schemacheck.validate(shape,schema,name)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    os.makedirs(args.outdir,exist_ok=True)
+    writeShapes(shapes,args.outdir)
+    failed= None
+    if args.build:
+        profile= os.path.join(os.path.dirname(args.template),
+         template["profile"])
+        failed= buildShapes(shapes,args.outdir,profile,
+         template.get("compress",True),args)
+    index= [ indexEntry(name,fields,shape,failed)
+     for name,fields,shape in shapes ]
+    with open(os.path.join(args.outdir,args.index),"w") as fd:
+        json.dump({ "template": args.template, "shapes": index },fd,
+         indent=1)
+    print("%d shapes"%(len(shapes)))
+    if failed:
+        print("%d shapes failed"%(len(failed)))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
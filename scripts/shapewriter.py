@@ -0,0 +1,429 @@
+# Copyright © 2022 Doug Jones
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+# writes MSTS/Open Rails text shape files without blender
+#
+# input is a list of parts, each a dictionary with:
+#  cutoff: viewing distance in meters
+#  material: dictionary with texture, mipMapBias, lighting
+#   ("NORMAL", "SPECULAR25" or "SPECULAR750") and transparency
+#   ("OPAQUE" or "ALPHA"), the same settings trackshape.py gives
+#   the blender exporter
+#  meshes: list of dictionaries with:
+#   coords: array of vertex positions in blender coordinates (z up)
+#   uvs: array of blender texture coordinates for each vertex
+#   loops: array of face vertex indexes in blender (counter clockwise) order
+#   loopTotals: array with the number of vertexes in each face
+#   anim: None or a dictionary with pivot, angle0 and angle1 for a part
+#    that rotates about the z axis, coords are relative to pivot
+# a distance level is made for each cutoff that contains all parts
+# with the same or larger cutoff, as the MAIN_nnnn collections do
+#
+# shape files can also be written compressed, as compressshape does:
+# SIMISA@F, the size of the uncompressed data as 4 bytes, @@@@ and then
+# the zlib compressed ascii text that follows SIMISA@@@@@@@@@@ in the
+# text form
+
+import math
+import numpy
+import struct
+import zlib
+
+header= "SIMISA@@@@@@@@@@JINX0s1t______\r\n\r\n"
+
+# largest number of vertices a sub object can have, vertex indexes are
+# 16 bits
+maxSubObjectVertices= 65535
+
+# light material index used in vtx_state for each lighting mode
+lightMaterials= { "NORMAL": -5, "SPECULAR25": -6, "SPECULAR750": -7 }
+
+# formats a number the way MSTS shape files usually do
+def fmt(x):
+    s= "%.5f"%(x)
+    s= s.rstrip("0").rstrip(".")
+    if s == "-0":
+        s= "0"
+    return s
+
+# converts a blender vector to MSTS coordinates (y up)
+def mstsVector(v):
+    return (v[0],v[2],v[1])
+
+# returns an array of triangles made by splitting each face into a fan
+def triangulate(loops,totals):
+    loops= numpy.asarray(loops)
+    totals= numpy.asarray(totals)
+    ntris= numpy.maximum(totals-2,0)
+    first= numpy.repeat(numpy.cumsum(totals)-totals,ntris)
+    i= numpy.arange(ntris.sum()) - numpy.repeat(numpy.cumsum(ntris)-ntris,ntris)
+    return numpy.stack([ loops[first], loops[first+i+1], loops[first+i+2] ],
+     axis=1)
+
+# returns an array of unit vertex normals for a mesh
+# each vertex normal is the area weighted sum of the normals of the
+# triangles that use the vertex
+def vertexNormals(coords,tris):
+    coords= numpy.asarray(coords,dtype=float)
+    normals= numpy.zeros(coords.shape)
+    p0= coords[tris[:,0]]
+    n= numpy.cross(coords[tris[:,1]]-p0,coords[tris[:,2]]-p0)
+    for k in range(3):
+        numpy.add.at(normals,tris[:,k],n)
+    d= numpy.linalg.norm(normals,axis=1)
+    normals[d==0]= (0,0,1)
+    d[d==0]= 1
+    return normals/d[:,None]
+
+# returns the index of item in list, adding it if not already present
+def listIndex(list,item):
+    if item not in list:
+        list.append(item)
+    return list.index(item)
+
+# writes a list of items as a counted block
+def writeBlock(out,indent,name,items,writeItem):
+    out.append("%s%s ( %d"%(indent,name,len(items)))
+    for item in items:
+        writeItem(item)
+    out.append("%s)"%(indent))
+
+# collects shape data from the parts and writes the text form of a shape
+# returns the shape file contents as a string
+def shapeText(parts):
+    points= []
+    uvPoints= []
+    normals= []
+    shaders= []
+    images= []
+    textures= []
+    vtxStates= []
+    primStates= []
+    matrices= [ ("MAIN",(0,0,0),None) ]
+    meshInfo= {}
+# adds points for each mesh once, even when it is used by several
+# distance levels
+    for part in parts:
+        mat= part["material"]
+        if mat["transparency"] == "ALPHA":
+            shader= "BlendATexDiff"
+        else:
+            shader= "TexDiff"
+        si= listIndex(shaders,shader)
+        ii= listIndex(images,mat["texture"])
+        ti= listIndex(textures,(ii,mat["mipMapBias"]))
+        for mesh in part["meshes"]:
+            if id(mesh) in meshInfo:
+                continue
+            anim= mesh["anim"]
+            mi= 0
+            if anim:
+                for i in range(1,len(matrices)):
+                    if matrices[i][2] is anim:
+                        mi= i
+                if mi == 0:
+                    mi= len(matrices)
+                    matrices.append(("ANIM%d"%(mi),
+                     mstsVector(anim["pivot"]),anim))
+            vsi= listIndex(vtxStates,(mi,lightMaterials[mat["lighting"]]))
+            psi= listIndex(primStates,(si,ti,vsi))
+            coords= mesh["coords"]
+            tris= triangulate(mesh["loops"],mesh["loopTotals"])
+            p0= len(points)
+            for i in range(len(coords)):
+                points.append(mstsVector(coords[i]))
+                uv= mesh["uvs"][i]
+                uvPoints.append((uv[0],1-uv[1]))
+            for nv in vertexNormals(coords,tris):
+                normals.append(mstsVector(nv))
+            meshInfo[id(mesh)]= splitMeshInfo({ "point0": p0,
+             "npoints": len(coords), "tris": tris, "primState": psi,
+             "shader": si, "matrix": mi, "vtxState": vsi })
+    out= []
+    out.append("shape (")
+    out.append("\tshape_header ( 00000000 00000000 )")
+    if points:
+        mins= [ min(p[i] for p in points) for i in range(3) ]
+        maxs= [ max(p[i] for p in points) for i in range(3) ]
+    else:
+        mins= maxs= [0,0,0]
+    center= [ (mins[i]+maxs[i])/2 for i in range(3) ]
+    radius= max([ math.sqrt(sum((p[i]-center[i])**2 for i in range(3)))
+     for p in points ] + [0])
+    out.append("\tvolumes ( 1")
+    out.append("\t\tvol_sphere (")
+    out.append("\t\t\tvector ( %s %s %s ) %s"%(fmt(center[0]),
+     fmt(center[1]),fmt(center[2]),fmt(radius)))
+    out.append("\t\t)")
+    out.append("\t)")
+    writeBlock(out,"\t","shader_names",shaders,
+     lambda s: out.append("\t\tnamed_shader ( %s )"%(s)))
+    out.append("\ttexture_filter_names ( 1")
+    out.append("\t\tnamed_filter_mode ( MipLinear )")
+    out.append("\t)")
+    writeBlock(out,"\t","points",points,
+     lambda p: out.append("\t\tpoint ( %s %s %s )"%(fmt(p[0]),fmt(p[1]),
+     fmt(p[2]))))
+    writeBlock(out,"\t","uv_points",uvPoints,
+     lambda p: out.append("\t\tuv_point ( %s %s )"%(fmt(p[0]),fmt(p[1]))))
+    writeBlock(out,"\t","normals",normals,
+     lambda p: out.append("\t\tvector ( %s %s %s )"%(fmt(p[0]),fmt(p[1]),
+     fmt(p[2]))))
+    out.append("\tsort_vectors ( 0 )")
+    out.append("\tcolours ( 0 )")
+    writeBlock(out,"\t","matrices",matrices,
+     lambda m: out.append("\t\tmatrix %s ( 1 0 0 0 1 0 0 0 1 %s %s %s )"%
+     (m[0],fmt(m[1][0]),fmt(m[1][1]),fmt(m[1][2]))))
+    writeBlock(out,"\t","images",images,
+     lambda i: out.append("\t\timage ( %s )"%(i)))
+    writeBlock(out,"\t","textures",textures,
+     lambda t: out.append("\t\ttexture ( %d 0 %s ff000000 )"%
+     (t[0],fmt(t[1]))))
+    out.append("\tlight_materials ( 0 )")
+    out.append("\tlight_model_cfgs ( 1")
+    out.append("\t\tlight_model_cfg ( 00000000")
+    out.append("\t\t\tuv_ops ( 1")
+    out.append("\t\t\t\tuv_op_copy ( 1 0 )")
+    out.append("\t\t\t)")
+    out.append("\t\t)")
+    out.append("\t)")
+    writeBlock(out,"\t","vtx_states",vtxStates,
+     lambda v: out.append("\t\tvtx_state ( 00000000 %d %d 0 00000002 )"%v))
+    writeBlock(out,"\t","prim_states",primStates,
+     lambda p: out.append(
+     "\t\tprim_state ( 00000000 %d tex_idxs ( 1 %d ) 0 %d 0 0 1 )"%p))
+    cutoffs= sorted(set([ part["cutoff"] for part in parts ]))
+    out.append("\tlod_controls ( 1")
+    out.append("\t\tlod_control (")
+    out.append("\t\t\tdistance_levels_header ( 0 )")
+    out.append("\t\t\tdistance_levels ( %d"%(len(cutoffs)))
+    for d in cutoffs:
+        info= []
+        for part in parts:
+            if part["cutoff"] >= d:
+                for mesh in part["meshes"]:
+                    info+= meshInfo[id(mesh)]
+        writeDistanceLevel(out,d,info,len(matrices))
+    out.append("\t\t\t)")
+    out.append("\t\t)")
+    out.append("\t)")
+    writeAnimations(out,matrices)
+    out.append(")")
+    return header+"\r\n".join(out)+"\r\n"
+
+# returns the pieces of a mesh that each fit in a sub object
+# each piece has the list of shape point indexes it uses in points and
+# its triangles as indexes into that list in tris
+# a mesh with too many vertices is split between its triangles
+def splitMeshInfo(mi):
+    p0= mi["point0"]
+    tris= mi["tris"]
+    if mi["npoints"] <= maxSubObjectVertices:
+        return [ dict(mi,points=list(range(p0,p0+mi["npoints"])),
+         tris=tris.tolist()) ]
+    pieces= []
+    local= {}
+    ptris= []
+    for tri in tris.tolist():
+        new= [ v for v in set(tri) if v not in local ]
+        if len(local)+len(new) > maxSubObjectVertices:
+            pieces.append((local,ptris))
+            local= {}
+            ptris= []
+        for v in tri:
+            if v not in local:
+                local[v]= len(local)
+        ptris.append(tuple(local[v] for v in tri))
+    pieces.append((local,ptris))
+    return [ dict(mi,points=[ p0+v for v in local ],tris=ptris)
+     for local,ptris in pieces ]
+
+# writes a single distance level
+# meshes are grouped into sub objects of at most maxSubObjectVertices
+# vertices, splitMeshInfo has already split larger meshes
+def writeDistanceLevel(out,d,info,nmatrices):
+    info= sorted(info,key=lambda m: m["vtxState"])
+    subObjects= [ [] ]
+    nverts= 0
+    for mi in info:
+        n= len(mi["points"])
+        if nverts+n > maxSubObjectVertices and subObjects[-1]:
+            subObjects.append([])
+            nverts= 0
+        subObjects[-1].append(mi)
+        nverts+= n
+    out.append("\t\t\t\tdistance_level (")
+    out.append("\t\t\t\t\tdistance_level_header (")
+    out.append("\t\t\t\t\t\tdlevel_selection ( %s )"%(fmt(d)))
+    out.append("\t\t\t\t\t\thierarchy ( %d %s )"%(nmatrices,
+     " ".join([ "-1" ]+[ "0" for i in range(1,nmatrices) ])))
+    out.append("\t\t\t\t\t)")
+    out.append("\t\t\t\t\tsub_objects ( %d"%(len(subObjects)))
+    for info in subObjects:
+        writeSubObject(out,info,nmatrices)
+    out.append("\t\t\t\t\t)")
+    out.append("\t\t\t\t)")
+
+# writes a sub object containing a primitive for each mesh
+def writeSubObject(out,info,nmatrices):
+    ind= "\t\t\t\t\t\t"
+    vertices= []
+    vertexSets= []
+    prims= []
+    ntris= 0
+    for mi in info:
+        n= len(mi["points"])
+        v0= len(vertices)
+        vertices+= mi["points"]
+        if vertexSets and vertexSets[-1][0] == mi["vtxState"]:
+            vertexSets[-1][2]+= n
+        else:
+            vertexSets.append([mi["vtxState"],v0,n])
+        prims.append((mi["primState"],
+         [ (v0+a,v0+b,v0+c) for a,b,c in mi["tris"] ]))
+        ntris+= len(mi["tris"])
+    if len(vertices) > maxSubObjectVertices:
+        raise ValueError("sub object has %d vertices, more than %d"%
+         (len(vertices),maxSubObjectVertices))
+    shaders= sorted(set([ mi["shader"] for mi in info ]))
+    nodes= sorted(set([ mi["matrix"] for mi in info ]))
+    out.append(ind+"sub_object (")
+    out.append(ind+"\tsub_object_header ( 00000400 -1 -1 000001d2 000001c4")
+    out.append(ind+"\t\tgeometry_info ( %d 1 0 %d 0 0 %d 0 0 0"%
+     (ntris,3*ntris,len(prims)))
+    out.append(ind+"\t\t\tgeometry_nodes ( %d"%(len(nodes)))
+    for node in nodes:
+        nprims= len([ mi for mi in info if mi["matrix"] == node ])
+        ntris= sum([ len(mi["tris"]) for mi in info if mi["matrix"] == node ])
+        out.append(ind+"\t\t\t\tgeometry_node ( 1 0 %d 0 0"%(nprims))
+        out.append(ind+"\t\t\t\t\tcullable_prims ( %d %d %d )"%
+         (nprims,ntris,3*ntris))
+        out.append(ind+"\t\t\t\t)")
+    out.append(ind+"\t\t\t)")
+    out.append(ind+"\t\t\tgeometry_node_map ( %d %s )"%(nmatrices,
+     " ".join([ str(nodes.index(i)) if i in nodes else "-1"
+     for i in range(nmatrices) ])))
+    out.append(ind+"\t\t)")
+    out.append(ind+"\t\tsubobject_shaders ( %d %s )"%(len(shaders),
+     " ".join([ str(s) for s in shaders ])))
+    out.append(ind+"\t\tsubobject_light_cfgs ( 1 0 ) 0")
+    out.append(ind+"\t)")
+    out.append(ind+"\tvertices ( %d"%(len(vertices)))
+    for pi in vertices:
+        out.append(ind+"\t\tvertex ( 00000000 %d %d ffffffff ff000000"%
+         (pi,pi))
+        out.append(ind+"\t\t\tvertex_uvs ( 1 %d )"%(pi))
+        out.append(ind+"\t\t)")
+    out.append(ind+"\t)")
+    writeBlock(out,ind+"\t","vertex_sets",vertexSets,
+     lambda vs: out.append(ind+"\t\tvertex_set ( %d %d %d )"%tuple(vs)))
+    out.append(ind+"\tprimitives ( %d"%(2*len(prims)))
+    for psi,tris in prims:
+        out.append(ind+"\t\tprim_state_idx ( %d )"%(psi))
+        out.append(ind+"\t\tindexed_trilist (")
+        out.append(ind+"\t\t\tvertex_idxs ( %d %s )"%(3*len(tris),
+         " ".join([ "%d %d %d"%t for t in tris ])))
+        out.append(ind+"\t\t\tnormal_idxs ( %d %s )"%(len(tris),
+         " ".join([ "%d 3"%(vertices[t[0]]) for t in tris ])))
+        out.append(ind+"\t\t\tflags ( %d %s )"%(len(tris),
+         " ".join([ "00000000" for t in tris ])))
+        out.append(ind+"\t\t)")
+    out.append(ind+"\t)")
+    out.append(ind+")")
+
+# returns a quaternion in MSTS form for a rotation about the blender z axis
+def zRotation(angle):
+    return (0,math.sin(angle/2),0,math.cos(angle/2))
+
+# writes the animations for parts that rotate about a pivot
+# each animated part has two key frames, like the blender keyframes
+# made by trackshape.py
+def writeAnimations(out,matrices):
+    if len(matrices) < 2:
+        return
+    out.append("\tanimations ( 1")
+    out.append("\t\tanimation ( 2 30")
+    out.append("\t\t\tanim_nodes ( %d"%(len(matrices)))
+    for name,pos,anim in matrices:
+        out.append("\t\t\t\tanim_node %s ("%(name))
+        if anim:
+            out.append("\t\t\t\t\tcontrollers ( 2")
+            out.append("\t\t\t\t\t\ttcb_rot ( 2")
+            for frame,angle in ((0,anim["angle0"]),(1,anim["angle1"])):
+                q= zRotation(angle)
+                out.append("\t\t\t\t\t\t\tslerp_rot ( %d %s %s %s %s )"%
+                 (frame,fmt(q[0]),fmt(q[1]),fmt(q[2]),fmt(q[3])))
+            out.append("\t\t\t\t\t\t)")
+            out.append("\t\t\t\t\t\tlinear_pos ( 2")
+            for frame in (0,1):
+                out.append("\t\t\t\t\t\t\tlinear_key ( %d %s %s %s )"%
+                 (frame,fmt(pos[0]),fmt(pos[1]),fmt(pos[2])))
+            out.append("\t\t\t\t\t\t)")
+            out.append("\t\t\t\t\t)")
+        else:
+            out.append("\t\t\t\t\tcontrollers ( 0 )")
+        out.append("\t\t\t\t)")
+    out.append("\t\t\t)")
+    out.append("\t\t)")
+    out.append("\t)")
+
+# writes a text shape file for a list of parts
+def writeShape(filename,parts,compress=False):
+    text= shapeText(parts)
+    if compress:
+        data= compressText(text)
+        with open(filename,"wb") as fd:
+            fd.write(data)
+        return
+    fd= open(filename,"w",encoding="utf-16-le",newline="")
+    fd.write("\ufeff"+text)
+    fd.close()
+
+# returns the compressed form of the text of a shape file
+# the text may start with a byte order mark
+# the compressed text is ascii, so other characters, e.g. in texture file
+# names, are an error
+def compressText(text):
+    text= text.lstrip("\ufeff")
+    if not text.startswith("SIMISA@@@@@@@@@@"):
+        raise ValueError("not a SIMISA text file")
+    try:
+        data= text[16:].encode("ascii")
+    except UnicodeEncodeError as e:
+        line= text.count("\n",0,16+e.start)+1
+        raise ValueError("cannot compress non-ascii character %r on line %d"%
+         (text[16+e.start],line))
+    return b"SIMISA@F"+struct.pack("<I",len(data))+b"@@@@"+ \
+     zlib.compress(data,9)
+
+# compresses a text shape file written by the blender exporter in place
+# files that are already compressed are left alone
+def compressShapeFile(filename):
+    with open(filename,"rb") as fd:
+        data= fd.read()
+    if data.startswith(b"SIMISA@F"):
+        return
+    if data.startswith(b"\xff\xfe"):
+        text= data[2:].decode("utf-16-le")
+    else:
+        text= data.decode("utf-8")
+    data= compressText(text)
+    with open(filename,"wb") as fd:
+        fd.write(data)
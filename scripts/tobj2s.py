@@ -1,30 +1,135 @@
 #	creates a .s file from terrain patch .obj file
+#	usage: blender -b --python tobj2s.py -- [--compress] [--lods *file.json*]
+#	 [--atlas *file.json*] *TILES/patch.obj*
+#	can also be imported, see buildworker.py
 
 import bpy
+import json
 import math
+import numpy
 import os
 import sys
 
-args= sys.argv[sys.argv.index("--")+1:]
-objfile= args[0]
-fname= objfile[6:-4]
-sfile= 'SHAPES/t'+fname+'.s'
-acefile= 'TEXTURES/t'+fname+'.ace'
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+import buildreport
+import shapewriter
 
-if "Cube" in bpy.data.objects:
-    obj= bpy.data.objects["Cube"]
-    bpy.data.objects.remove(obj)
+# distance levels made for each patch and the fraction of faces kept in
+# each level for each object, 0 leaves the object out of a level
+# objects that are not listed are kept whole in every level and the last
+# ratio is used for any levels past the end of an object's list
+# can be changed with --lods *file.json* after --
+defaultLODs= {
+    "distances": [ 500, 1000, 2000 ],
+    "ratios": {
+        "main": [ 1, .5, .25 ],
+        "walls": [ 1, 1, .5 ],
+        "tracks": [ 1, 1, 1 ],
+        "roads": [ 1, 1, 1 ],
+        "dirtroads": [ 1, 1, 1 ],
+        "trees": [ 1, .5, .25 ],
+        "field": [ 1, .5, .25 ],
+        "field20": [ 1, .5, .25 ],
+        "field40": [ 1, .5, .25 ],
+        "fieldw": [ 1, .5, .25 ],
+        "atlas": [ 1, .5, .25 ]
+    }
+}
+# reads a .obj file written by dte's writeCsgObj one line at a time
+# returns a dictionary with the vertex positions, loop texture
+# coordinates, loop vertex indexes, face sizes and face smooth flags of
+# each object, only the vertices used by an object are kept
+def readObj(filename):
+    verts= []
+    uvs= []
+    objects= {}
+    faces= None
+    smooth= False
+    with open(filename,"r") as fd:
+        for line in fd:
+            words= line.split()
+            if not words:
+                continue
+            if words[0] == "v":
+                verts.append(words[1:4])
+            elif words[0] == "vt":
+                uvs.append(words[1:3])
+            elif words[0] == "f":
+                if faces is None:
+                    faces= objects.setdefault("default",{ "verts": [],
+                     "uvs": [], "totals": [], "smooth": [] })
+                for w in words[1:]:
+                    i= w.split("/")
+                    v= int(i[0])
+                    faces["verts"].append(v-1 if v>0 else len(verts)+v)
+                    if len(i)>1 and i[1]:
+                        t= int(i[1])
+                        faces["uvs"].append(t-1 if t>0 else len(uvs)+t)
+                    else:
+                        faces["uvs"].append(-1)
+                faces["totals"].append(len(words)-1)
+                faces["smooth"].append(smooth)
+            elif words[0] == "o":
+                name= words[1] if len(words)>1 else "default"
+                faces= objects.setdefault(name,{ "verts": [], "uvs": [],
+                 "totals": [], "smooth": [] })
+            elif words[0] == "s":
+                smooth= len(words)>1 and words[1] not in ("off","0")
+    verts= numpy.array(verts,dtype=float).reshape(-1,3)
+    uvs= numpy.array(uvs+[[0,0]],dtype=float)
+    result= {}
+    for name,faces in objects.items():
+        if not faces["totals"]:
+            continue
+        used,loops= numpy.unique(numpy.array(faces["verts"]),
+         return_inverse=True)
+        result[name]= { "coords": verts[used],
+         "uvs": uvs[numpy.array(faces["uvs"])],
+         "loops": loops.astype(numpy.int32),
+         "loopTotals": numpy.array(faces["totals"],dtype=numpy.int32),
+         "smooth": numpy.array(faces["smooth"],dtype=bool) }
+    return result
 
-bpy.ops.import_scene.obj(filepath=objfile,axis_forward="Y",axis_up="Z")
-maincol= bpy.data.collections.new("MAIN")
-main2000col= bpy.data.collections.new("MAIN_2000")
-maincol.children.link(main2000col)
-bpy.context.scene.collection.children.link(maincol)
+# makes a blender object linked to the scene from readObj data,
+# copying the arrays into the mesh with foreach_set
+def makeObjObject(name,data):
+    coords= data["coords"]
+    loops= data["loops"]
+    totals= data["loopTotals"]
+    mesh= bpy.data.meshes.new(name)
+    mesh.vertices.add(len(coords))
+    mesh.vertices.foreach_set("co",coords.ravel())
+    mesh.loops.add(len(loops))
+    mesh.loops.foreach_set("vertex_index",loops)
+    mesh.polygons.add(len(totals))
+    starts= numpy.zeros(len(totals),dtype=numpy.int32)
+    starts[1:]= numpy.cumsum(totals)[:-1]
+    mesh.polygons.foreach_set("loop_start",starts)
+    mesh.polygons.foreach_set("loop_total",totals)
+    mesh.polygons.foreach_set("use_smooth",data["smooth"])
+    uvLayer= mesh.uv_layers.new()
+    uvLayer.data.foreach_set("uv",data["uvs"].ravel())
+    mesh.update(calc_edges=True)
+    obj= bpy.data.objects.new(name,mesh)
+    bpy.context.scene.collection.objects.link(obj)
+    return obj
 
-root= None
+# the objects made by dte with their textures and transparency
+objectMaterials= [
+    ("main","fieldwmt.ace","OPAQUE"),
+    ("walls","StoneGreyCourseRough.ace","OPAQUE"),
+    ("tracks","roadbed.ace","OPAQUE"),
+    ("roads","road2lane.ace","OPAQUE"),
+    ("dirtroads","dirtroad.ace","OPAQUE"),
+    ("trees","treesmt.ace","OPAQUE"),
+    ("field","fieldmt.ace","OPAQUE"),
+    ("field20","field20mt.ace","OPAQUE"),
+    ("field40","field40mt.ace","OPAQUE"),
+    ("fieldw","fieldwmt.ace","OPAQUE")
+]
+names= [ name for name,texture,trans in objectMaterials ]+[ "atlas" ]
 
-def addObject(name,texture,trans):
-    global root
+def addMaterial(name,texture,trans):
     if name in bpy.data.objects:
         obj= bpy.data.objects[name]
         obj.data.use_auto_smooth= 1
@@ -35,22 +140,202 @@ def addObject(name,texture,trans):
         mat.msts.Lighting= "NORMAL"
         mat.msts.Transparency= trans
         obj.active_material= mat
-        if root:
-            obj.parent= root
-        else:
-            root= obj
-        main2000col.objects.link(obj)
-
-addObject("main","fieldwmt.ace","OPAQUE")
-addObject("walls","StoneGreyCourseRough.ace","OPAQUE")
-addObject("tracks","roadbed.ace","OPAQUE")
-addObject("roads","road2lane.ace","OPAQUE")
-addObject("dirtroads","dirtroad.ace","OPAQUE")
-addObject("trees","treesmt.ace","OPAQUE")
-addObject("field","fieldmt.ace","OPAQUE")
-addObject("field20","field20mt.ace","OPAQUE")
-addObject("field40","field40mt.ace","OPAQUE")
-addObject("fieldw","fieldwmt.ace","OPAQUE")
-
-bpy.ops.export.msts_s(filepath=sfile)
-#bpy.ops.wm.save_as_mainfile(filepath=sfile+".blend")
+
+# moves the texture coordinates of each face by whole numbers so the face
+# starts in the first texture repeat, returns None if any face is larger
+# than repeat
+def faceLocalUVs(data,repeat):
+    totals= data["loopTotals"]
+    starts= numpy.zeros(len(totals),dtype=numpy.int64)
+    starts[1:]= numpy.cumsum(totals)[:-1]
+    face= numpy.repeat(numpy.arange(len(totals)),totals)
+    uvs= data["uvs"]
+    shift= numpy.floor(numpy.minimum.reduceat(uvs,starts,axis=0)+1e-6)
+    uvs= uvs-shift[face]
+    if uvs.max() > repeat+1e-6:
+        return None
+    return uvs
+
+# combines the objects whose textures are in the atlas into one object
+# named atlas, with their texture coordinates moved into their cells
+# atlas is a dictionary with:
+#  texture: atlas texture file name
+#  transparency: OPAQUE or ALPHA
+#  cells: dictionary of texture file name to [ u0, v0, u1, v1, repeat ],
+#   the cell's corners in blender texture coordinates and the number of
+#   times the texture is repeated across the cell in each direction
+# objects with faces that cover more than repeat copies of their texture
+# keep their own material
+def makeAtlasObject(objects,atlas):
+    parts= []
+    for name,texture,trans in objectMaterials:
+        if name not in objects or texture not in atlas["cells"] or \
+          trans != atlas.get("transparency","OPAQUE"):
+            continue
+        u0,v0,u1,v1,repeat= atlas["cells"][texture]
+        uvs= faceLocalUVs(objects[name],repeat)
+        if uvs is None:
+            print("%s faces are too large for the atlas"%(name))
+            continue
+        data= dict(objects.pop(name))
+        data["uvs"]= numpy.array([u0,v0]) + \
+         uvs/repeat*numpy.array([u1-u0,v1-v0])
+        parts.append(data)
+    if not parts:
+        return
+    loops= []
+    vi= 0
+    for data in parts:
+        loops.append(data["loops"]+vi)
+        vi+= len(data["coords"])
+    objects["atlas"]= {
+     "coords": numpy.concatenate([ d["coords"] for d in parts ]),
+     "uvs": numpy.concatenate([ d["uvs"] for d in parts ]),
+     "loops": numpy.concatenate(loops).astype(numpy.int32),
+     "loopTotals": numpy.concatenate([ d["loopTotals"] for d in parts ]),
+     "smooth": numpy.concatenate([ d["smooth"] for d in parts ]) }
+
+# returns an array of the vertex positions of a mesh
+def meshCoords(mesh):
+    co= numpy.empty(3*len(mesh.vertices))
+    mesh.vertices.foreach_get("co",co)
+    return co.reshape(-1,3)
+
+# puts the vertices on the edges of the patch in a vertex group named
+# border so decimation leaves them alone and the patch still meets its
+# neighbors, returns the positions of the border vertices
+def addBorderGroup(obj,bounds):
+    co= meshCoords(obj.data)
+    lo,hi= bounds
+    onBorder= (numpy.abs(co[:,0]-lo[0])<.01) | \
+     (numpy.abs(co[:,0]-hi[0])<.01) | \
+     (numpy.abs(co[:,1]-lo[1])<.01) | (numpy.abs(co[:,1]-hi[1])<.01)
+    group= obj.vertex_groups.new(name="border")
+    group.add([ int(i) for i in numpy.nonzero(onBorder)[0] ],1,"REPLACE")
+    return set(map(tuple,numpy.round(co[onBorder],3)))
+
+# returns a copy of obj with ratio of its faces linked to col
+# the border vertices are protected by an inverted vertex group and the
+# undecimated mesh is used if any of them would be lost
+def decimatedCopy(obj,ratio,col,border):
+    copy= obj.copy()
+    copy.data= obj.data.copy()
+    copy.parent= None
+    col.objects.link(copy)
+    if ratio >= 1:
+        return copy
+    mod= copy.modifiers.new("decimate","DECIMATE")
+    mod.ratio= ratio
+    mod.vertex_group= "border"
+    mod.invert_vertex_group= True
+    mod.vertex_group_factor= 1000
+    depsgraph= bpy.context.evaluated_depsgraph_get()
+    mesh= bpy.data.meshes.new_from_object(copy.evaluated_get(depsgraph))
+    copy.modifiers.remove(mod)
+    left= set(map(tuple,numpy.round(meshCoords(mesh),3)))
+    if border <= left:
+        full= copy.data
+        copy.data= mesh
+        bpy.data.meshes.remove(full)
+        mesh.use_auto_smooth= 1
+        mesh.auto_smooth_angle= math.radians(80)
+    else:
+        print("keeping all of %s, decimation moves its border"%(obj.name))
+        bpy.data.meshes.remove(mesh)
+    return copy
+
+# makes a MAIN_nnnn collection in maincol for each distance level
+# the first object in each level is the parent of the others
+def makeLevels(maincol,lods):
+    objects= [ bpy.data.objects[name] for name in names
+     if name in bpy.data.objects ]
+    if not objects:
+        return
+    co= numpy.concatenate([ meshCoords(obj.data) for obj in objects
+     if obj.name == "main" ] or [ meshCoords(obj.data) for obj in objects ])
+    bounds= (co.min(axis=0),co.max(axis=0))
+    borders= { obj.name: addBorderGroup(obj,bounds) for obj in objects }
+    distances= lods["distances"]
+    for i in range(len(distances)):
+        col= bpy.data.collections.new("MAIN_%4.4d"%(distances[i]))
+        maincol.children.link(col)
+        root= None
+        for obj in objects:
+            ratios= lods["ratios"].get(obj.name,[1])
+            ratio= ratios[min(i,len(ratios)-1)]
+            if ratio <= 0:
+                continue
+            if i==0 and ratio>=1:
+                col.objects.link(obj)
+                copy= obj
+            else:
+                with buildreport.stage("decimate"):
+                    copy= decimatedCopy(obj,ratio,col,borders[obj.name])
+            if root:
+                copy.parent= root
+            else:
+                root= copy
+
+# converts one patch .obj file to a .s file
+# objects are combined into an atlas object if atlas is given, the atlas
+# texture must already be in TEXTURES
+def convertPatch(objfile,lods,atlas=None,compress=False):
+    fname= objfile[6:-4]
+    sfile= 'SHAPES/t'+fname+'.s'
+    buildreport.item(objfile)
+    if atlas and \
+      not os.path.exists(os.path.join("TEXTURES",atlas["texture"])):
+        buildreport.failed()
+        raise Exception("atlas texture TEXTURES/%s not found"%
+         (atlas["texture"]))
+    if "Cube" in bpy.data.objects:
+        obj= bpy.data.objects["Cube"]
+        bpy.data.objects.remove(obj)
+    with buildreport.stage("import"):
+        objects= readObj(objfile)
+        if atlas:
+            makeAtlasObject(objects,atlas)
+        for name,data in objects.items():
+            makeObjObject(name,data)
+    maincol= bpy.data.collections.new("MAIN")
+    bpy.context.scene.collection.children.link(maincol)
+    with buildreport.stage("materials"):
+        for name,texture,trans in objectMaterials:
+            addMaterial(name,texture,trans)
+        if atlas:
+            addMaterial("atlas",atlas["texture"],
+             atlas.get("transparency","OPAQUE"))
+    makeLevels(maincol,lods)
+    with buildreport.stage("export"):
+        bpy.ops.export.msts_s(filepath=sfile)
+    if compress:
+        with buildreport.stage("compress"):
+            shapewriter.compressShapeFile(sfile)
+    buildreport.output(sfile)
+#    bpy.ops.wm.save_as_mainfile(filepath=sfile+".blend")
+
+# converts the patch named in args, after optional --compress, --lods and
+# --atlas options
+def main(args):
+    args= buildreport.enable("tobj2s.py",args)
+    compress= False
+    if args[0] == "--compress":
+        compress= True
+        args= args[1:]
+    lods= { "distances": defaultLODs["distances"],
+     "ratios": dict(defaultLODs["ratios"]) }
+    if args[0] == "--lods":
+        with open(args[1]) as fd:
+            config= json.load(fd)
+        lods["distances"]= config.get("distances",lods["distances"])
+        lods["ratios"].update(config.get("ratios",{}))
+        args= args[2:]
+    atlas= None
+    if args[0] == "--atlas":
+        with open(args[1]) as fd:
+            atlas= json.load(fd)
+        args= args[2:]
+    convertPatch(args[0],lods,atlas,compress)
+
+if __name__ == "__main__":
+    main(sys.argv[sys.argv.index("--")+1:])
@@ -0,0 +1,147 @@
+# Copyright © 2022 Doug Jones
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+# compiles track profile json files for trackshape.py
+#
+# the profile is checked against profile.schema.json and each LOD's
+# polylines are indexed by part with their vertices packed into arrays
+# the compiled profile is saved in __pycache__ next to the profile file
+# and used again until the profile, the schema or this version changes
+#
+# a compiled LOD has the same keys as the json LOD except Polylines,
+# which is replaced by:
+#  polylines: list of all compiled polylines
+#  parts: dictionary of the compiled polylines for each part name
+# a compiled polyline has:
+#  name: Name of the polyline
+#  part: part name or None
+#  deltaTexCoord: array of u and v change per meter
+#  vertices: dictionary of arrays of x, y, u, v for each vertex, with keys
+#   Vertices, verticesi and verticeso for the taper variants in the profile
+#  key: string that is the same for polylines with the same geometry
+# and the compiled profile has mirrored, which is true when every LOD looks
+# the same reflected left to right with left and right parts swapped
+
+import hashlib
+import json
+import os
+import pickle
+import numpy
+
+import schemacheck
+
+compilerVersion= 2
+
+# returns the packed x, y, u, v array for a list of profile vertices
+def packVertices(vertices):
+    return numpy.array([ v["Position"][:2]+v["TexCoord"][:2]
+     for v in vertices ],dtype=float)
+
+def compilePolyline(polyline):
+    data= {}
+    vertices= {}
+    for k in ("DeltaTexCoord","Vertices","verticesi","verticeso"):
+        if k in polyline:
+            data[k]= polyline[k]
+            if k != "DeltaTexCoord":
+                vertices[k]= packVertices(polyline[k])
+    return { "name": polyline.get("Name"), "part": polyline.get("part"),
+     "deltaTexCoord": numpy.array(polyline["DeltaTexCoord"],dtype=float),
+     "vertices": vertices, "key": json.dumps(data,sort_keys=True) }
+
+def compileLOD(lod):
+    clod= { k: v for k,v in lod.items() if k != "Polylines" }
+    clod["polylines"]= [ compilePolyline(p) for p in lod["Polylines"] ]
+    clod["parts"]= {}
+    for polyline in clod["polylines"]:
+        if polyline["part"] is not None:
+            clod["parts"].setdefault(polyline["part"],[]).append(polyline)
+    return clod
+
+# returns the part name on the other side for left and right parts
+def mirrorPart(part):
+    if part and part.startswith("left"):
+        return "right"+part[4:]
+    if part and part.startswith("right"):
+        return "left"+part[5:]
+    return part
+
+# returns a comparable form of a compiled polyline, reflected left to
+# right if mirror is true
+def polylineShape(polyline,mirror):
+    vertices= []
+    for k in sorted(polyline["vertices"]):
+        v= polyline["vertices"][k]
+        if mirror:
+            v= v[::-1]*[ -1, 1, 1, 1 ]
+        vertices.append((k,tuple(numpy.round(v,6).ravel())))
+    part= polyline["part"]
+    if mirror:
+        part= mirrorPart(part)
+    return (str(part),tuple(polyline["deltaTexCoord"]),tuple(vertices))
+
+# returns true if the LOD's polylines reflected left to right are the
+# same as its polylines
+def mirroredLOD(clod):
+    return sorted(polylineShape(p,False) for p in clod["polylines"]) == \
+     sorted(polylineShape(p,True) for p in clod["polylines"])
+
+# checks a profile against the schema and returns its compiled form
+def compileProfile(profile,name="profile"):
+    schemacheck.validate(profile,
+     schemacheck.readSchema("profile.schema.json"),name)
+    cprofile= { k: v for k,v in profile.items() if k != "LODs" }
+    cprofile["LODs"]= [ compileLOD(lod) for lod in profile["LODs"] ]
+    cprofile["mirrored"]= all(mirroredLOD(lod) for lod in cprofile["LODs"])
+    return cprofile
+
+# returns the name of the file that holds a compiled profile
+def cacheFile(filename):
+    filename= os.path.abspath(filename)
+    return os.path.join(os.path.dirname(filename),"__pycache__",
+     os.path.basename(filename)+".pickle")
+
+# reads and compiles a profile file, using the saved compiled form when
+# the profile has not changed
+def loadProfile(filename):
+    h= hashlib.sha1(str(compilerVersion).encode())
+    with open(filename,"rb") as fd:
+        data= fd.read()
+    h.update(data)
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+     "profile.schema.json"),"rb") as fd:
+        h.update(fd.read())
+    h= h.hexdigest()
+    cfile= cacheFile(filename)
+    try:
+        with open(cfile,"rb") as fd:
+            cache= pickle.load(fd)
+        if cache["hash"] == h:
+            return cache["profile"]
+    except (OSError,pickle.PickleError,EOFError,KeyError,TypeError):
+        pass
+    profile= compileProfile(json.loads(data.decode()),filename)
+    try:
+        os.makedirs(os.path.dirname(cfile),exist_ok=True)
+        with open(cfile,"wb") as fd:
+            pickle.dump({ "hash": h, "profile": profile },fd)
+    except OSError:
+        pass
+    return profile
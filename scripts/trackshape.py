@@ -19,21 +19,35 @@
 # THE SOFTWARE.
 
 # creates a track .s file from profile and path information
-# usage: blender -b --python trackshape.py -- *shape.json* *profile.json*
+# usage: blender -b --python trackshape.py -- *shape.json*... *profile.json*
+#    or: blender -b --python trackshape.py -- --manifest *manifest.json*
+# shapes without a switch stand can also be made without blender:
+#        python3 trackshape.py *shape.json*... *profile.json*
+# --compress before the shape files writes compressed .s files
 
-import bpy
+try:
+    import bpy
+except ImportError:
+    bpy= None
 import math
 import mathutils
+import numpy
 import os
 import sys
 import json
 import functools
+import traceback
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+import buildreport
+import shapewriter
+import trackprofile
 
 def readjson(filename):
     fd= open(filename,'r')
     return json.load(fd)
 
-if "Cube" in bpy.data.objects:
+if bpy and "Cube" in bpy.data.objects:
     obj= bpy.data.objects["Cube"]
     bpy.data.objects.remove(obj)
 
@@ -71,9 +85,21 @@ def headingVector(angle):
     dy= math.sin(a)
     return mathutils.Vector([dy,dx,0])
 
+# returns the number of segments needed to keep the distance between an
+# arc of radius r and angle a (radians) and its chords under tolerance
+def arcSegments(r,a,tolerance):
+    if tolerance >= r:
+        return 1
+    return max(1,int(math.ceil(a/(2*math.acos(1-tolerance/r)))))
+
 # creates an array of center line points and perpendicular vectors
 # for the specified path
-def getCenterLine(path):
+# arcs have one segment per degree unless the move gives the number of
+# segments or a chord tolerance in meters is given
+# without a chord tolerance the exact lines and arcs of the path are kept
+# too, a coarse center line is left without them so switch and crossing
+# positions are found where its own segments cross
+def getCenterLine(path,tolerance=None):
     cl= []
     start= path["start"]
     p= mathutils.Vector([start[0],start[2],start[1]])
@@ -91,6 +117,7 @@ def getCenterLine(path):
             d= math.radians(move[1])
             m= int(math.ceil(abs(move[1])))
             if len(move)>2: m= move[2]
+            elif tolerance: m= arcSegments(r,abs(d),tolerance)
             angle= d/m
             t= abs(r*math.tan(angle/2))
             if t < .01: m=0
@@ -111,8 +138,47 @@ def getCenterLine(path):
             heading= heading+math.degrees(h)
 #        print("point %f %f %f  %f"%(p.x,p.y,p.z,heading))
     path["centerLine"]= cl
+    if tolerance:
+        path.pop("elements",None)
+    else:
+        path["elements"]= getPathElements(path)
     return cl
 
+# returns a list of the exact lines and arcs that make up a path
+# headings are in radians, positive is clockwise
+# arcs that getCenterLine skips because they are too small are left out
+def getPathElements(path):
+    elements= []
+    start= path["start"]
+    x= start[0]
+    y= start[2]
+    heading= math.radians(path["angle"])
+    dist= 0
+    for move in path["moves"]:
+        if move[1]==0:
+            elements.append({ "type":"line", "x":x, "y":y,
+             "heading":heading, "length":move[0], "dist":dist })
+            x+= math.sin(heading)*move[0]
+            y+= math.cos(heading)*move[0]
+            dist+= move[0]
+        else:
+            r= move[0]
+            d= math.radians(move[1])
+            m= int(math.ceil(abs(move[1])))
+            if len(move)>2: m= move[2]
+            if abs(r*math.tan(d/m/2)) < .01:
+                continue
+            sign= 1 if d>0 else -1
+            cx= x + math.cos(heading)*r*sign
+            cy= y - math.sin(heading)*r*sign
+            elements.append({ "type":"arc", "cx":cx, "cy":cy, "radius":r,
+             "sign":sign, "heading":heading, "sweep":abs(d), "dist":dist })
+            heading+= d
+            x= cx - math.cos(heading)*r*sign
+            y= cy + math.sin(heading)*r*sign
+            dist+= r*abs(d)
+    return elements
+
 def makeStraight(x1,x2):
     cl= []
     dir= headingVector(0)
@@ -184,15 +250,69 @@ def copyCenterLine(centerLine,dist1,dist2,dist3,dist4):
         dist= dist+d
     return cl
 
+# makes a uniform grid index of the segments of a center line
+# each segment is listed in every cell its bounding box touches
+# plus a one cell margin
+def makeSegmentGrid(cl):
+    length= 0
+    for k in range(len(cl)-1):
+        length+= (cl[k+1]["point"]-cl[k]["point"]).length
+    size= max(1,length/max(1,len(cl)-1))
+    cells= {}
+    for k in range(len(cl)-1):
+        p1= cl[k]["point"]
+        p2= cl[k+1]["point"]
+        ix1= math.floor(min(p1.x,p2.x)/size)-1
+        ix2= math.floor(max(p1.x,p2.x)/size)+1
+        iy1= math.floor(min(p1.y,p2.y)/size)-1
+        iy2= math.floor(max(p1.y,p2.y)/size)+1
+        for ix in range(ix1,ix2+1):
+            for iy in range(iy1,iy2+1):
+                cells.setdefault((ix,iy),[]).append(k)
+    return { "size": size, "cells": cells }
+
+# returns the sorted indexes of the segments in grid cells crossed by
+# the line from p1 to p2
+def gridSegments(grid,p1,p2):
+    size= grid["size"]
+    cells= grid["cells"]
+    x0= p1.x/size
+    y0= p1.y/size
+    x1= p2.x/size
+    y1= p2.y/size
+    ix= math.floor(x0)
+    iy= math.floor(y0)
+    n= abs(math.floor(x1)-ix) + abs(math.floor(y1)-iy)
+    dx= x1-x0
+    dy= y1-y0
+    stepx= 1 if dx>0 else -1
+    stepy= 1 if dy>0 else -1
+    tdx= abs(1/dx) if dx!=0 else math.inf
+    tdy= abs(1/dy) if dy!=0 else math.inf
+    tx= ((ix+1-x0) if dx>0 else (x0-ix))*tdx if dx!=0 else math.inf
+    ty= ((iy+1-y0) if dy>0 else (y0-iy))*tdy if dy!=0 else math.inf
+    segs= set(cells.get((ix,iy),[]))
+    for i in range(n):
+        if tx < ty:
+            ix+= stepx
+            tx+= tdx
+        else:
+            iy+= stepy
+            ty+= tdy
+        segs.update(cells.get((ix,iy),[]))
+    return sorted(segs)
+
 # copies perpendicular information from cl2 to cl1
+# a grid index of cl2 limits each perpendicular to nearby segments
 def copyPerp(cl1,cl2):
+    grid= makeSegmentGrid(cl2)
     for i in range(len(cl1)):
         p= cl1[i]["point"]
         perp= cl1[i]["perp"]
         for j in range(5):
             p11= p+perp*100
             p12= p-perp*100
-            for k in range(len(cl2)-1):
+            for k in gridSegments(grid,p11,p12):
                 p21= cl2[k]["point"]
                 p22= cl2[k+1]["point"]
                 pi= segSegInt(p11,p12,p21,p22)
@@ -205,11 +325,11 @@ def copyPerp(cl1,cl2):
                     break
         cl1[i]["perp"]= perp
 
-# finds the crossing point between two center lines each
-# offset by the specified amount (negative offset is to the left)
-# returns the intersection point and the distance down each line
-# returns None if it is no crossing point
-def findCrossing(cl1,cl2,offset1,offset2):
+# returns the pairs of segment indexes of cl1 and cl2 in the order they
+# are tested by findCrossings and the distance down each line to the start
+# of each segment
+def crossingSegmentPairs(cl1,cl2):
+    pairs= []
     dist10= cl1[0]["point"].length
     dist20= cl2[0]["point"].length
     dist1= 0
@@ -217,127 +337,398 @@ def findCrossing(cl1,cl2,offset1,offset2):
     i1= 0
     i2= 0
     while i1<len(cl1)-1 and i2<len(cl2)-1:
-        p11= cl1[i1]["point"] + cl1[i1]["perp"]*offset1
-        p12= cl1[i1+1]["point"] + cl1[i1+1]["perp"]*offset1
-        p21= cl2[i2]["point"] + cl2[i2]["perp"]*offset2
-        p22= cl2[i2+1]["point"] + cl2[i2+1]["perp"]*offset2
-        pi= segSegInt(p11,p12,p21,p22)
-        if pi:
-            d1= (pi-p11).length
-            d2= (pi-p21).length
-#            print("crossing %f %f  %f %f %d %d %f %f"%
-#            (offset1,offset2,pi.x,pi.y,i1,i2,dist1+d1,dist2+d2))
-            return { "pi": pi, "dist1": dist1+d1, "dist2": dist2+d2 }
+        pairs.append((i1,i2,dist1,dist2))
         d1= (cl1[i1+1]["point"]-cl1[i1]["point"]).length
         d2= (cl2[i2+1]["point"]-cl2[i2]["point"]).length
-#        print(" %d %d %f %f"%(i1,i2,d1,d2))
         if dist10+dist1+d1 < dist20+dist2+d2:
             i1= i1+1
             dist1= dist1+d1
         else:
             i2= i2+1
             dist2= dist2+d2
-#    print("no crossing %f %f"%(offset1,offset2))
-    return None
+    return pairs
+
+# returns arrays of the center line points and perpendiculars
+def centerLineArrays(cl):
+    points= numpy.array([ [c["point"].x,c["point"].y,c["point"].z]
+     for c in cl ])
+    perps= numpy.array([ [c["perp"].x,c["perp"].y,c["perp"].z]
+     for c in cl ])
+    return points,perps
+
+# finds the crossing points between two center lines for a list of
+# (offset1,offset2) pairs, each line offset by the specified amount
+# (negative offset is to the left)
+# the segment pairs are walked once and all offsets are tested together
+# returns a list with the intersection point and the distance down each
+# line for each offset pair or None if there is no crossing point
+def findCrossings(cl1,cl2,offsets):
+    pairs= crossingSegmentPairs(cl1,cl2)
+    if not pairs:
+        return [ None for o in offsets ]
+    i1,i2,dist1,dist2= [ numpy.array(a) for a in zip(*pairs) ]
+    points1,perps1= centerLineArrays(cl1)
+    points2,perps2= centerLineArrays(cl2)
+    offsets= numpy.array(offsets,dtype=float)
+    line1= points1[None,:,:] + perps1[None,:,:]*offsets[:,0,None,None]
+    line2= points2[None,:,:] + perps2[None,:,:]*offsets[:,1,None,None]
+    a= line1[:,i1]
+    b= line1[:,i1+1]
+    c= line2[:,i2]
+    d= line2[:,i2+1]
+    ax,ay= a[:,:,0],a[:,:,1]
+    bx,by= b[:,:,0],b[:,:,1]
+    cx,cy= c[:,:,0],c[:,:,1]
+    dx,dy= d[:,:,0],d[:,:,1]
+    denom= ax*(dy-cy) + bx*(cy-dy) + cx*(ay-by) + dx*(by-ay)
+    with numpy.errstate(divide="ignore",invalid="ignore"):
+        s= (ax*(dy-cy) + cx*(ay-dy) + dx*(cy-ay)) / denom
+        t= -(ax*(cy-by) + bx*(ay-cy) + cx*(by-ay)) / denom
+    hit= (denom!=0) & (s>=0) & (s<=1) & (t>=0) & (t<=1)
+    x= ax + s*(bx-ax)
+    y= ay + s*(by-ay)
+    result= []
+    for k in range(len(offsets)):
+        if not hit[k].any():
+#            print("no crossing %f %f"%(offsets[k,0],offsets[k,1]))
+            result.append(None)
+            continue
+        j= hit[k].argmax()
+        pi= mathutils.Vector([x[k,j],y[k,j],0])
+        d1= (pi-mathutils.Vector(a[k,j])).length
+        d2= (pi-mathutils.Vector(c[k,j])).length
+#        print("crossing %f %f  %f %f %d %d %f %f"%(offsets[k,0],
+#        offsets[k,1],pi.x,pi.y,i1[j],i2[j],dist1[j]+d1,dist2[j]+d2))
+        result.append({ "pi": pi, "dist1": dist1[j]+d1,
+         "dist2": dist2[j]+d2 })
+    return result
+
+# returns the points where two elements offset by o1 and o2 intersect
+# as a list of (x,y) pairs, the points may be outside either element
+def elementIntersections(e1,o1,e2,o2):
+    if e1["type"]=="arc" and e2["type"]=="line":
+        return elementIntersections(e2,o2,e1,o1)
+    if e1["type"]=="line":
+        h1= e1["heading"]
+        qx= e1["x"] + math.cos(h1)*o1
+        qy= e1["y"] - math.sin(h1)*o1
+        dx= math.sin(h1)
+        dy= math.cos(h1)
+        if e2["type"]=="line":
+            h2= e2["heading"]
+            q2x= e2["x"] + math.cos(h2)*o2
+            q2y= e2["y"] - math.sin(h2)*o2
+            d2x= math.sin(h2)
+            d2y= math.cos(h2)
+            denom= dx*d2y - dy*d2x
+            if abs(denom) < 1e-12:
+                return [] # parallel or collinear
+            s= ((q2x-qx)*d2y - (q2y-qy)*d2x) / denom
+            return [ (qx+dx*s,qy+dy*s) ]
+        r= e2["radius"] - o2*e2["sign"]
+        fx= qx - e2["cx"]
+        fy= qy - e2["cy"]
+        b= fx*dx + fy*dy
+        disc= b*b - (fx*fx+fy*fy-r*r)
+        if disc < -1e-9*r*r:
+            return []
+        disc= math.sqrt(max(0,disc))
+        return [ (qx+dx*s,qy+dy*s) for s in (-b-disc,-b+disc) ]
+    r1= e1["radius"] - o1*e1["sign"]
+    r2= e2["radius"] - o2*e2["sign"]
+    dx= e2["cx"] - e1["cx"]
+    dy= e2["cy"] - e1["cy"]
+    d= math.sqrt(dx*dx+dy*dy)
+    if d == 0:
+        return []
+    a= (r1*r1 - r2*r2 + d*d) / (2*d)
+    h2= r1*r1 - a*a
+    if h2 < -1e-9*r1*r1:
+        return []
+    h= math.sqrt(max(0,h2))
+    x= e1["cx"] + a*dx/d
+    y= e1["cy"] + a*dy/d
+    return [ (x+h*dy/d,y-h*dx/d), (x-h*dy/d,y+h*dx/d) ]
+
+# returns the center line distance from the start of the path to the
+# point (x,y) on element e offset by o, or None if the point is not
+# on the element
+def elementDistance(e,o,x,y):
+    eps= 1e-9
+    if e["type"]=="line":
+        h= e["heading"]
+        s= (x-e["x"])*math.sin(h) + (y-e["y"])*math.cos(h)
+        if s<-eps or s>e["length"]+eps:
+            return None
+        return e["dist"] + max(0,min(e["length"],s))
+    k= e["radius"]*e["sign"] - o
+    h= math.atan2((y-e["cy"])/k,(e["cx"]-x)/k)
+    theta= (e["sign"]*(h-e["heading"])) % (2*math.pi)
+    if theta > 2*math.pi-eps:
+        theta-= 2*math.pi
+    if theta<-eps or theta>e["sweep"]+eps:
+        return None
+    return e["dist"] + e["radius"]*max(0,min(e["sweep"],theta))
+
+# returns the center line length of a path
+def pathLength(path):
+    e= path["elements"][-1] if path["elements"] else None
+    if e is None:
+        return 0
+    if e["type"]=="line":
+        return e["dist"]+e["length"]
+    return e["dist"]+e["radius"]*e["sweep"]
+
+# finds the crossing point between two paths offset by o1 and o2
+# using the exact lines and arcs of the paths
+# distances are measured along the center line from the start of the
+# center line, which is the end of the path if it has been reversed
+# returns the crossing nearest the start of both lines or None
+def findElementCrossing(path1,path2,o1,o2):
+    best= None
+    rev1= path1.get("reversed",False)
+    rev2= path2.get("reversed",False)
+    if rev1: o1= -o1
+    if rev2: o2= -o2
+    for e1 in path1["elements"]:
+        for e2 in path2["elements"]:
+            for x,y in elementIntersections(e1,o1,e2,o2):
+                dist1= elementDistance(e1,o1,x,y)
+                dist2= elementDistance(e2,o2,x,y)
+                if dist1 is None or dist2 is None:
+                    continue
+                if rev1: dist1= pathLength(path1)-dist1
+                if rev2: dist2= pathLength(path2)-dist2
+                if best is None or dist1+dist2 < best["dist1"]+best["dist2"]:
+                    best= { "pi": mathutils.Vector([x,y,0]),
+                     "dist1": dist1, "dist2": dist2 }
+    return best
 
-# makes a mesh and object for a single part of the track model
+# finds the crossing points between two paths for a list of
+# (offset1,offset2) pairs
+# the exact lines and arcs are used when available so that the results
+# do not depend on the number of center line segments, otherwise the
+# center line segments, so that rails drawn along a center line made with
+# a chord tolerance are cut where they cross
+def findPathCrossings(path1,path2,offsets):
+    if "elements" not in path1 or "elements" not in path2:
+        return findCrossings(path1["centerLine"],path2["centerLine"],offsets)
+    return [ findElementCrossing(path1,path2,o1,o2) for o1,o2 in offsets ]
+
+# returns the packed profile vertices used at each center line point
+# for a compiled polyline, selecting taper vertices at the ends
 # ends is a bit flag that controls taper at end of rail
 #  bit 1 is near end taper to inside
 #  bit 2 is far end taper to inside
 #  bit 4 is near end taper to outside
 #  bit 8 is far end taper to outside
-def makeMesh(lod,shape,part,centerLine,ends,anim):
-    pivot= mathutils.Vector([0,0,0])
+def polylineRows(polyline,n,ends):
+    vertices= polyline["vertices"]
+    rows= numpy.repeat(vertices["Vertices"][None,:,:],n,axis=0)
+    if "verticesi" in vertices and (ends&2)!=0:
+        rows[n-1]= vertices["verticesi"]
+    elif "verticeso" in vertices and (ends&8)!=0:
+        rows[n-1]= vertices["verticeso"]
+    if "verticesi" in vertices and (ends&1)!=0:
+        rows[0]= vertices["verticesi"]
+    elif "verticeso" in vertices and (ends&4)!=0:
+        rows[0]= vertices["verticeso"]
+    return rows
+
+# geometry made by makeMesh for the current track shape
+# keyed by polyline contents, center line identity, ends and anim so that
+# LODs and part lines that repeat a polyline share the arrays
+meshCache= {}
+
+# records a meshCache key of arrays made for a center line, so that
+# releaseCenterLine can find them
+def addCenterLineKey(centerLine,key):
+    meshCache.setdefault(("keys",id(centerLine)),(centerLine,[]))[1].append(key)
+
+# returns cached arrays of the center line points and perpendiculars
+def cachedCenterLineArrays(centerLine):
+    key= ("centerLine",id(centerLine))
+    if key not in meshCache:
+        meshCache[key]= (centerLine,centerLineArrays(centerLine))
+        addCenterLineKey(centerLine,key)
+    return meshCache[key][1]
+
+# makes vertex, texture coordinate and face index arrays for one polyline
+# following a center line, for all center line points and profile
+# vertices at once
+# face indexes start at zero
+# texture coordinates continue from dist0 meters along the path
+def polylineArrays(polyline,part,centerLine,ends,pivot,dist0=0):
+    points,perps= cachedCenterLineArrays(centerLine)
+    dtc= polyline["deltaTexCoord"]
+    index= numpy.arange(len(centerLine))
+    if part and part=="end" and len(index)>1:
+        index= index[[0,-1]]
+    rows= polylineRows(polyline,len(centerLine),ends)[index]
+    pos= rows[:,:,0:2]
+    texc= rows[:,:,2:4]
+    p= points[index]
+    perp= perps[index]
+    dist= numpy.full(len(index),float(dist0))
+    dist[1:]+= numpy.cumsum(numpy.linalg.norm(p[1:]-p[:-1],axis=1))
+    xyz= p[:,None,:] + perp[:,None,:]*pos[:,:,0,None] - pivot
+    xyz[:,:,2]+= pos[:,:,1]
+    uv= numpy.empty(texc.shape)
+    uv[:,:,0]= texc[:,:,0] + dist[:,None]*dtc[0]
+    uv[:,:,1]= 1 - (texc[:,:,1] + dist[:,None]*dtc[1])
+    nrows,nverts= pos.shape[0],pos.shape[1]
+    loops= []
+    totals= []
+    if part and part=="end":
+        for i in range(nrows):
+            j= numpy.arange(nverts)
+            if i>0:
+                j= nverts-1-j
+            loops.append(i*nverts+j)
+            totals.append(numpy.array([nverts]))
+    elif nrows>1 and nverts>1:
+        row= numpy.arange(nrows-1)[:,None]*nverts
+        j= numpy.arange(1,nverts)[None,:]
+        quads= numpy.stack([ row+j-1, row+j, row+nverts+j,
+         row+nverts+j-1 ],axis=2)
+        loops.append(quads.ravel())
+        totals.append(numpy.full(quads.shape[0]*quads.shape[1],4))
+    return (xyz.reshape(-1,3),uv.reshape(-1,2),loops,totals)
+
+# makes the mesh data for a single part of the track model
+# and adds it to the LOD's list of meshes
+# polyline arrays and whole meshes are reused from meshCache when the
+# same geometry has already been made for another LOD or part line
+# meshes made for a chunk of a long path keep its chunk index so that
+# mergeMeshes only combines meshes in the same chunk
+def makeMesh(lod,shape,part,centerLine,ends,anim,dist0=0,chunk=None):
+    pivot= numpy.zeros(3)
     if anim:
-        pivot= anim["pivot"]
+        pivot= numpy.array(anim["pivot"])
+    keys= []
+    arrays= []
+    polylines= lod["polylines"]
+    if part:
+        polylines= lod["parts"].get(part,[])
+    for polyline in polylines:
+        key= (polyline["key"],id(centerLine),ends,id(anim),
+         part=="end")
+        if key not in meshCache:
+            meshCache[key]= (centerLine,anim,
+             polylineArrays(polyline,part,centerLine,ends,pivot,dist0))
+            addCenterLineKey(centerLine,key)
+        keys.append(key)
+        arrays.append(meshCache[key][2])
+    if not arrays:
+        return
+    material= lodMaterial(lod)
+    meshKey= (tuple(keys),tuple(sorted(material.items())))
+    if meshKey in meshCache:
+        lod["meshes"].append(meshCache[meshKey])
+        return
     coords= []
     uvs= []
-    faces= []
+    loops= []
+    totals= []
     vi= 0
-    polylines= lod["Polylines"]
-    for polyline in polylines:
-        if part and polyline["part"]!=part:
-            continue
-        dtc= polyline["DeltaTexCoord"]
-        point0= centerLine[0]["point"]
-        dist= 0
-        for i in range(len(centerLine)):
-            if part and part=="end" and i>0 and i<len(centerLine)-1:
-                continue
-            point= centerLine[i]["point"]
-            perp= centerLine[i]["perp"]
-            dist= dist+(point-point0).length
-            if i==0 and "verticesi" in polyline and (ends&1)!=0:
-                verts= polyline["verticesi"]
-            elif i==0 and "verticeso" in polyline and (ends&4)!=0:
-                verts= polyline["verticeso"]
-            elif i==len(centerLine)-1 and "verticesi" in polyline and (ends&2)!=0:
-                verts= polyline["verticesi"]
-            elif i==len(centerLine)-1 and "verticeso" in polyline and (ends&8)!=0:
-                verts= polyline["verticeso"]
-            else:
-                verts= polyline["Vertices"]
-            nverts= len(verts)
-            for j in range(len(verts)):
-                pos= verts[j]["Position"]
-                texc= verts[j]["TexCoord"]
-                p= point+perp*pos[0]+mathutils.Vector([0,0,pos[1]])-pivot
-                coords.append(p)
-                uv= [texc[0]+dist*dtc[0],1-(texc[1]+dist*dtc[1])]
-                uvs.append(uv)
-            if part and part=="end":
-                face= []
-                for j in range(len(verts)):
-                    if i>0:
-                        face.append(vi+nverts-1-j)
-                    else:
-                        face.append(vi+j)
-                faces.append(face)
-            else:
-                for j in range(len(verts)):
-                    if i>0 and j>0:
-                        vij= vi+j-1
-                        face= (vij-nverts,vij-nverts+1,vij+1,vij)
-                        faces.append(face)
-            point0= point
-            vi= vi+nverts
-    if not coords:
-        return
+    for xyz,uv,l,t in arrays:
+        coords.append(xyz)
+        uvs.append(uv)
+        loops+= [ vi+a for a in l ]
+        totals+= t
+        vi+= len(xyz)
+    meshData= { "coords": numpy.concatenate(coords),
+     "uvs": numpy.concatenate(uvs),
+     "loops": numpy.concatenate(loops).astype(numpy.int32) if loops else
+      numpy.zeros(0,dtype=numpy.int32),
+     "loopTotals": numpy.concatenate(totals).astype(numpy.int32) if totals
+      else numpy.zeros(0,dtype=numpy.int32),
+     "anim": anim, "chunk": chunk }
+    meshCache[meshKey]= meshData
+    lod["meshes"].append(meshData)
+
+# returns the material settings used for a LOD
+def lodMaterial(lod):
+    if lod["LightModelName"] == "OptSpecular25":
+        lighting= "SPECULAR25"
+    elif lod["LightModelName"] == "OptSpecular750":
+        lighting= "SPECULAR750"
+    else:
+        lighting= "NORMAL"
+    if lod["ShaderName"].startswith("BlendA"):
+        transparency= "ALPHA"
+    else:
+        transparency= "OPAQUE"
+    return { "texture": lod["TexName"],
+     "mipMapBias": lod["MipMapLevelOfDetailBias"],
+     "lighting": lighting, "transparency": transparency }
+
+# places an object at its pivot and adds its rotation key frames
+def animateObject(obj,anim):
+    pivot= anim["pivot"]
+    obj.location= pivot.x, pivot.y, pivot.z
+    obj.rotation_euler= 0, 0, anim["angle0"]
+    obj.keyframe_insert("rotation_euler",frame=0)
+    obj.rotation_euler= 0, 0, anim["angle1"]
+    obj.keyframe_insert("rotation_euler",frame=1)
+    obj.rotation_euler= 0, 0, anim["angle0"]
+
+# makes a blender mesh and object for mesh data made by makeMesh
+# the arrays are copied into the mesh with foreach_set
+# mesh data used more than once shares a single blender mesh
+def makeObject(lod,meshData):
+    coords= meshData["coords"]
+    loops= meshData["loops"]
+    totals= meshData["loopTotals"]
+    anim= meshData["anim"]
     name= lod["Name"]
-    texture= lod["TexName"]
+    if "mesh" in meshData:
+        obj= bpy.data.objects.new(name,meshData["mesh"])
+        lod["objects"].append(obj)
+        if anim:
+            animateObject(obj,anim)
+        return
     mesh= bpy.data.meshes.new(name)
-    mesh.from_pydata(coords,[],faces)
+    meshData["mesh"]= mesh
+    mesh.vertices.add(len(coords))
+    mesh.vertices.foreach_set("co",coords.astype(numpy.float32).ravel())
+    mesh.loops.add(len(loops))
+    mesh.loops.foreach_set("vertex_index",loops)
+    mesh.polygons.add(len(totals))
+    mesh.polygons.foreach_set("loop_start",
+     (numpy.cumsum(totals)-totals).astype(numpy.int32))
+    mesh.polygons.foreach_set("loop_total",totals)
+    mesh.update(calc_edges=True)
     mesh.calc_normals()
 #    mesh.calc_normals_split()
 #    mesh.create_normals_split()
     obj= bpy.data.objects.new(name,mesh)
     lod["objects"].append(obj)
     if anim:
-        obj.location= pivot.x, pivot.y, pivot.z
-        obj.rotation_euler= 0, 0, anim["angle0"]
-        obj.keyframe_insert("rotation_euler",frame=0)
-        obj.rotation_euler= 0, 0, anim["angle1"]
-        obj.keyframe_insert("rotation_euler",frame=1)
-        obj.rotation_euler= 0, 0, anim["angle0"]
+        animateObject(obj,anim)
     mesh.uv_layers.new(name="UVMap")
-    uvlayer= mesh.uv_layers.active.data
-    for poly in mesh.polygons:
-        for li in range(poly.loop_start,poly.loop_start+poly.loop_total):
-            uvlayer[li].uv= uvs[mesh.loops[li].vertex_index]
-    mat= bpy.data.materials.new(texture)
-    mat.msts.BaseColorFilepath= texture
-    mat.msts.MipMapLODBias= lod["MipMapLevelOfDetailBias"]
-    if lod["LightModelName"] == "OptSpecular25":
-        mat.msts.Lighting= "SPECULAR25"
-    elif lod["LightModelName"] == "OptSpecular750":
-        mat.msts.Lighting= "SPECULAR750"
-    else:
-        mat.msts.Lighting= "NORMAL"
-    if lod["ShaderName"].startswith("BlendA"):
-        mat.msts.Transparency= "ALPHA"
-    else:
-        mat.msts.Transparency= "OPAQUE"
-    obj.active_material= mat
+    mesh.uv_layers.active.data.foreach_set("uv",
+     meshData["uvs"][loops].astype(numpy.float32).ravel())
+    obj.active_material= poolMaterial(lodMaterial(lod))
+
+# returns the blender material for lodMaterial settings
+# a material is only made the first time the settings are used, later
+# objects and shapes made in the same session share it
+# materials are found by a name made from the settings so ones lost when
+# a file is opened are simply made again
+def poolMaterial(material):
+    name= "%s %s %s %g"%(material["texture"],material["lighting"],
+     material["transparency"],material["mipMapBias"])
+    mat= bpy.data.materials.get(name)
+    if mat is not None and "trackMaterial" in mat:
+        return mat
+    mat= bpy.data.materials.new(name)
+    mat["trackMaterial"]= True
+    mat.msts.BaseColorFilepath= material["texture"]
+    mat.msts.MipMapLODBias= material["mipMapBias"]
+    mat.msts.Lighting= material["lighting"]
+    mat.msts.Transparency= material["transparency"]
+    return mat
 
 # makes a list of partial center lines for the parts needed to make
 # a switch model
@@ -358,16 +749,19 @@ def makeSwitchPartLines(shape):
     grlen2= 3
     if "guardRailLengths" in shape:
         grlen1,grlen2= shape["guardRailLengths"]
-    points0= findCrossing(cl1,cl2,0,0)
-    points= findCrossing(cl1,cl2,(f+rh)/2,-(f+rh)/2)
-    frogPoint= findCrossing(cl1,cl2,g/2,-g/2)
-    frogPointRH= findCrossing(cl1,cl2,g/2+rh,-g/2-rh)
-    frogStartL= findCrossing(cl1,cl2,g/2,-g/2+f)
-    frogStartLRH= findCrossing(cl1,cl2,g/2+rh,-g/2+f)
-    frogStartR= findCrossing(cl1,cl2,g/2-f,-g/2)
-    frogStartRRH= findCrossing(cl1,cl2,g/2-f,-g/2-rh)
-    frogStart= findCrossing(cl1,cl2,g/2-f/2,-g/2+f/2)
-    frogStartRH= findCrossing(cl1,cl2,g/2-f/2+rh/2,-g/2+f/2-rh/2)
+    points0,points,frogPoint,frogPointRH,frogStartL,frogStartLRH, \
+     frogStartR,frogStartRRH,frogStart,frogStartRH= findPathCrossings(
+     shape["paths"][0],shape["paths"][1],[
+     (0,0),
+     ((f+rh)/2,-(f+rh)/2),
+     (g/2,-g/2),
+     (g/2+rh,-g/2-rh),
+     (g/2,-g/2+f),
+     (g/2+rh,-g/2+f),
+     (g/2-f,-g/2),
+     (g/2-f,-g/2-rh),
+     (g/2-f/2,-g/2+f/2),
+     (g/2-f/2+rh/2,-g/2+f/2-rh/2) ])
     animL= None
     animR= None
     if points0 and points:
@@ -397,7 +791,8 @@ def makeSwitchPartLines(shape):
             else:
                 animL= {"pivot":pivot1,"angle0":a,"angle1":0}
                 animR= {"pivot":pivot2,"angle0":0,"angle1":-a}
-        bpy.context.scene.frame_end= 2
+        if bpy:
+            bpy.context.scene.frame_end= 2
     if frogStart:
         x= frogStart["dist1"]
         line= copyCenterLine(cl1,x-.1,x,x+grlen1-.2,x+grlen1)
@@ -527,20 +922,23 @@ def hasCrossing(paths):
     return False
 
 # adds parts to partLines for a single crossing rail
-# rail follows cl1 offset to side defined by sign
-def addCrossingRail(partLines,part,cl1,cl2,sign,ends1,ends2,ends3):
+# rail follows path1 offset to side defined by sign
+def addCrossingRail(partLines,part,path1,path2,sign,ends1,ends2,ends3):
+    cl1= path1["centerLine"]
 #    print("addcrossingrail %s %.0f"%(part,sign))
     g= profile["gauge"]/2
     rh= profile["railhead"]
     f= profile["flangeway"]
-    x1= findCrossing(cl1,cl2,sign*(g+rh),g+rh)["dist1"]
-    x2= findCrossing(cl1,cl2,sign*g,g)["dist1"]
-    x3= findCrossing(cl1,cl2,sign*(g+rh),g-f)["dist1"]
-    x4= findCrossing(cl1,cl2,sign*g,g-f)["dist1"]
-    x5= findCrossing(cl1,cl2,sign*(g+rh),-g+f)["dist1"]
-    x6= findCrossing(cl1,cl2,sign*g,-g+f)["dist1"]
-    x7= findCrossing(cl1,cl2,sign*g,-g)["dist1"]
-    x8= findCrossing(cl1,cl2,sign*(g+rh),-g-rh)["dist1"]
+    x1,x2,x3,x4,x5,x6,x7,x8= [ c["dist1"] for c in findPathCrossings(
+     path1,path2,[
+     (sign*(g+rh),g+rh),
+     (sign*g,g),
+     (sign*(g+rh),g-f),
+     (sign*g,g-f),
+     (sign*(g+rh),-g+f),
+     (sign*g,-g+f),
+     (sign*g,-g),
+     (sign*(g+rh),-g-rh) ]) ]
     x1,x2,x3,x4,x5,x6,x7,x8= sorted([x1,x2,x3,x4,x5,x6,x7,x8])
     line= copyCenterLine(cl1,None,-1,x1,x2)
     partLines.append({"part":part,"centerLine":line,"ends":ends1})
@@ -550,21 +948,26 @@ def addCrossingRail(partLines,part,cl1,cl2,sign,ends1,ends2,ends3):
     partLines.append({"part":part,"centerLine":line,"ends":ends3})
 
 # adds parts to partLines for a single crossing guard rail
-# rail follows cl1 offset to side defined by sign
-def addCrossingGuardRail(partLines,part,cl1,cl2,sign,shape,ends1,ends2,ends3):
+# rail follows path1 offset to side defined by sign
+def addCrossingGuardRail(partLines,part,path1,path2,sign,shape,
+ ends1,ends2,ends3):
+    cl1= path1["centerLine"]
 #    print("addcrossingguardrail %s %.0f"%(part,sign))
     g= profile["gauge"]/2
     rh= profile["railhead"]
     f= profile["flangeway"]
-    x1= findCrossing(cl1,cl2,sign*(g-f-rh),g+rh)["dist1"]
-    x2= findCrossing(cl1,cl2,sign*(g-f),g+rh)["dist1"]
-    x3= findCrossing(cl1,cl2,sign*(g-f-rh),g-f)["dist1"]
-    x4= findCrossing(cl1,cl2,sign*(g-f),g-f)["dist1"]
-    x5= findCrossing(cl1,cl2,sign*(g-f-rh),-g+f)["dist1"]
-    x6= findCrossing(cl1,cl2,sign*(g-f),-g+f)["dist1"]
-    x7= findCrossing(cl1,cl2,sign*(g-f),-g-rh)["dist1"]
-    x8= findCrossing(cl1,cl2,sign*(g-f-rh),-g-rh)["dist1"]
-    skew= x3 - findCrossing(cl1,cl2,-sign*(g-f),g-f)["dist1"]
+    x1,x2,x3,x4,x5,x6,x7,x8,x9= [ c["dist1"] for c in findPathCrossings(
+     path1,path2,[
+     (sign*(g-f-rh),g+rh),
+     (sign*(g-f),g+rh),
+     (sign*(g-f-rh),g-f),
+     (sign*(g-f),g-f),
+     (sign*(g-f-rh),-g+f),
+     (sign*(g-f),-g+f),
+     (sign*(g-f),-g-rh),
+     (sign*(g-f-rh),-g-rh),
+     (-sign*(g-f),g-f) ]) ]
+    skew= x3 - x9
     x1,x2,x3,x4,x5,x6,x7,x8= sorted([x1,x2,x3,x4,x5,x6,x7,x8])
     len1= 1
     len2= 2
@@ -610,17 +1013,23 @@ def addCrossingGuardRail(partLines,part,cl1,cl2,sign,shape,ends1,ends2,ends3):
 # a crossing model
 def makeCrossingPartLines(shape):
     partLines= []
-    cl1= shape["paths"][0]["centerLine"]
-    cl2= shape["paths"][1]["centerLine"]
+    path1= shape["paths"][0]
+    path2= shape["paths"][1]
+    cl1= path1["centerLine"]
+    cl2= path2["centerLine"]
     try:
-        addCrossingRail(partLines,"leftrail",cl1,cl2,-1,2,6,1)
-        addCrossingRail(partLines,"rightrail",cl1,cl2,1,2,9,1)
-        addCrossingRail(partLines,"leftrail",cl2,cl1,-1,2,9,1)
-        addCrossingRail(partLines,"rightrail",cl2,cl1,1,2,6,1)
-        addCrossingGuardRail(partLines,"leftguardrail",cl1,cl2,-1,shape,3,6,6)
-        addCrossingGuardRail(partLines,"rightguardrail",cl1,cl2,1,shape,9,9,6)
-        addCrossingGuardRail(partLines,"leftguardrail",cl2,cl1,-1,shape,9,9,3)
-        addCrossingGuardRail(partLines,"rightguardrail",cl2,cl1,1,shape,3,6,6)
+        addCrossingRail(partLines,"leftrail",path1,path2,-1,2,6,1)
+        addCrossingRail(partLines,"rightrail",path1,path2,1,2,9,1)
+        addCrossingRail(partLines,"leftrail",path2,path1,-1,2,9,1)
+        addCrossingRail(partLines,"rightrail",path2,path1,1,2,6,1)
+        addCrossingGuardRail(partLines,"leftguardrail",path1,path2,-1,shape,
+         3,6,6)
+        addCrossingGuardRail(partLines,"rightguardrail",path1,path2,1,shape,
+         9,9,6)
+        addCrossingGuardRail(partLines,"leftguardrail",path2,path1,-1,shape,
+         9,9,3)
+        addCrossingGuardRail(partLines,"rightguardrail",path2,path1,1,shape,
+         3,6,6)
         partLines.append({"part":"ballast","centerLine":cl1,"ends":0})
         partLines.append({"part":"ties","centerLine":cl1,"ends":0})
         partLines.append({"part":"ballast","centerLine":cl2,"ends":0})
@@ -638,20 +1047,137 @@ def flipCenterLine(cl):
         perp.x*= -1
         perp.y*= -1
 
+# switch and crossing tracks made by the current makeShapes call, keyed by
+# geometryKey
+# each holds the profile, the part lines for each chord tolerance and the
+# meshes for each LOD
+# cleared by makeShapes, so the profile ids in the keys are those of the
+# profiles it holds and no meshes of earlier calls are kept
+madeTracks= {}
+
+# shape file keys that decide the part lines of a switch or crossing
+geometryFields= ("paths","mainroute","derail","stub","guardRailLengths",
+ "ends")
+
+# returns a key for the geometry of a shape made with a profile
+def geometryKey(shape,profile):
+    geometry= { k: shape[k] for k in geometryFields if k in shape }
+    geometry["paths"]= [ { k: path[k] for k in path
+     if k in ("start","angle","moves","copyties") }
+     for path in shape["paths"] ]
+    return (json.dumps(geometry,sort_keys=True),id(profile))
+
+# returns the geometry keys of a shape reflected left to right
+# the paths are listed in reverse so they stay in left to right order
+def mirrorGeometry(shape):
+    geometry= { k: shape[k] for k in geometryFields if k in shape }
+    paths= []
+    for path in reversed(shape["paths"]):
+        start= path["start"]
+        mpath= { "start": [ -start[0], start[1], start[2] ],
+         "angle": -path["angle"],
+         "moves": [ [ m[0], -m[1] ]+m[2:] for m in path["moves"] ] }
+        if "copyties" in path:
+            mpath["copyties"]= path["copyties"]
+        paths.append(mpath)
+    geometry["paths"]= paths
+    if "mainroute" in shape:
+        geometry["mainroute"]= len(paths)-1-shape["mainroute"]
+    if "derail" in shape:
+        geometry["derail"]= { "left": "right",
+         "right": "left" }[shape["derail"]]
+    return geometry
+
+# returns an animation reflected left to right
+def mirrorAnim(anim):
+    pivot= anim["pivot"].copy()
+    pivot.x= -pivot.x
+    return { "pivot": pivot, "angle0": -anim["angle0"],
+     "angle1": -anim["angle1"] }
+
+# returns part lines reflected left to right
+# points are reflected and perpendiculars changed to point right again,
+# left and right parts are swapped and animations turn the other way
+# center lines and animations shared by several part lines stay shared
+def mirrorPartLines(partLines):
+    lines= {}
+    anims= {}
+    mirrored= []
+    for pl in partLines:
+        cl= pl["centerLine"]
+        if id(cl) not in lines:
+            lines[id(cl)]= [ { "point": mathutils.Vector([ -p["point"].x,
+             p["point"].y, p["point"].z ]), "perp": mathutils.Vector([
+             p["perp"].x, -p["perp"].y, p["perp"].z ]) } for p in cl ]
+        mpl= { "part": trackprofile.mirrorPart(pl["part"]),
+         "centerLine": lines[id(cl)], "ends": pl["ends"] }
+        if "anim" in pl:
+            if id(pl["anim"]) not in anims:
+                anims[id(pl["anim"])]= mirrorAnim(pl["anim"])
+            mpl["anim"]= anims[id(pl["anim"])]
+        mirrored.append(mpl)
+    return mirrored
+
+# returns mesh data reflected left to right
+# the loops of each face are reversed to keep the faces pointing out
+def mirrorMesh(meshData,anim):
+    coords= meshData["coords"]*[ -1, 1, 1 ]
+    loops= meshData["loops"]
+    totals= meshData["loopTotals"]
+    starts= numpy.cumsum(totals)-totals
+    face= numpy.repeat(numpy.arange(len(totals)),totals)
+    pos= numpy.arange(len(loops))
+    loops= loops[2*starts[face]+totals[face]-1-pos]
+    return { "coords": coords, "uvs": meshData["uvs"], "loops": loops,
+     "loopTotals": totals, "anim": anim }
+
+# returns a LOD's meshes reflected left to right
+# anims collects the reflected animations by pivot and angles
+def mirrorMeshes(meshes,anims):
+    mirrored= {}
+    for meshData in meshes:
+        if id(meshData) in mirrored:
+            continue
+        anim= None
+        if meshData["anim"]:
+            anim= mirrorAnim(meshData["anim"])
+            key= (tuple(anim["pivot"]),anim["angle0"],anim["angle1"])
+            anim= anims.setdefault(key,anim)
+        mirrored[id(meshData)]= mirrorMesh(meshData,anim)
+    return [ mirrored[id(meshData)] for meshData in meshes ]
+
 # makes a track model for the specified shape
+# LODs with different ChordTolerance values get their own center lines
+# and part lines
+# a switch or crossing that is the mirror image of one already made with
+# the same profile in this session is made from its part lines reflected,
+# or from its meshes reflected if the profile is mirrored
 def makeTrack(shape,profile,collection):
     paths= shape["paths"]
-    for path in paths:
-        cl= getCenterLine(path)
+    lods= profile["LODs"]
+    tolerances= []
+    for lod in lods:
+        if lod.get("ChordTolerance") not in tolerances:
+            tolerances.append(lod.get("ChordTolerance"))
+    geometry= None
+    source= None
+    if "tunnel" not in shape and len(paths) == 2:
+        geometry= geometryKey(shape,profile)
+        source= madeTracks.get(geometryKey(mirrorGeometry(shape),profile))
+    with buildreport.stage("getCenterLine"):
+        for path in paths:
+            cl= getCenterLine(path,tolerances[0])
     if hasCrossing(paths):
         angle= paths[1]["angle"]
         if angle<-90 or angle>90:
             flipCenterLine(paths[1]["centerLine"])
+            paths[1]["reversed"]= True
     tunnel= None
     if "tunnel" in shape:
         tunnel= shape["tunnel"]
         if "path" in tunnel:
-            getCenterLine(tunnel["path"])
+            with buildreport.stage("getCenterLine"):
+                getCenterLine(tunnel["path"],tolerances[0])
         else:
             tunnel["path"]= paths[0]
     ends= False
@@ -660,16 +1186,313 @@ def makeTrack(shape,profile,collection):
     paths.sort(key=functools.cmp_to_key(pathCenterLineCmp))
 #    for path in paths:
 #        printCenterLine(path["centerLine"])
-    partLines= None
-    if "mainroute" in shape:
-        partLines= makeSwitchPartLines(shape)
-    elif hasCrossing(paths):
-        partLines= makeCrossingPartLines(shape)
-    lods= profile["LODs"]
+    meshCache.clear()
+    anims= {}
     cutoffs= set()
+    made= { "profile": profile, "partLines": {} }
+    if source and profile["mirrored"]:
+        with buildreport.stage("mirror"):
+            for lod,meshes in zip(lods,source["meshes"]):
+                lod["meshes"]= mirrorMeshes(meshes,anims)
+        if bpy and anims:
+            bpy.context.scene.frame_end= 2
+    else:
+        for tolerance in tolerances:
+            if tolerance != tolerances[0]:
+                with buildreport.stage("getCenterLine"):
+                    remakeCenterLines(paths,tunnel,tolerance)
+            partLines= None
+            with buildreport.stage("partLines"):
+                if source:
+                    partLines= mirrorPartLines(source["partLines"][tolerance])
+                elif "mainroute" in shape:
+                    partLines= makeSwitchPartLines(shape)
+                elif hasCrossing(paths):
+                    partLines= makeCrossingPartLines(shape)
+            made["partLines"][tolerance]= partLines
+            for pl in partLines or []:
+                if "anim" in pl:
+                    anim= pl["anim"]
+                    key= (tuple(anim["pivot"]),anim["angle0"],anim["angle1"])
+                    pl["anim"]= anims.setdefault(key,anim)
+            if source and bpy and anims:
+                bpy.context.scene.frame_end= 2
+            tlods= [ lod for lod in lods
+             if lod.get("ChordTolerance") == tolerance ]
+            with buildreport.stage("makeMesh"):
+                makeMeshes(shape,profile,tlods,paths,partLines,tunnel,ends)
+        with buildreport.stage("mergeMeshes"):
+            mergeMeshes(lods)
+        with buildreport.stage("weld"):
+            weldMeshes(lods)
+        if geometry and made["partLines"][tolerances[0]]:
+            made["meshes"]= [ list(lod["meshes"]) for lod in lods ]
+            madeTracks[geometry]= made
     for lod in lods:
-        lod["objects"]= []
         cutoffs= cutoffs | { lod["CutoffRadius"] }
+    if collection is None:
+        return
+    with buildreport.stage("makeObject"):
+        makeObjects(lods,cutoffs,collection)
+
+# combines the meshes without anim of the LODs with the same cutoff and
+# material into one mesh kept by the first of those LODs, so each is
+# exported as a single primitive
+# animated meshes are left alone so they can still move
+# meshes of different chunks of a long path are kept apart and a merged
+# mesh is not made larger than a sub object can hold, see shapewriter.py
+def mergeMeshes(lods):
+    groups= {}
+    for lod in lods:
+        key= (lod["CutoffRadius"],tuple(sorted(lodMaterial(lod).items())))
+        groups.setdefault(key,[]).append(lod)
+    for group in groups.values():
+        chunks= {}
+        for lod in group:
+            for meshData in lod["meshes"]:
+                if meshData["anim"]:
+                    continue
+                static= chunks.setdefault(meshData.get("chunk"),[])
+                if not any(meshData is m for m in static):
+                    static.append(meshData)
+            lod["meshes"]= [ m for m in lod["meshes"] if m["anim"] ]
+        merged= []
+        for static in chunks.values():
+            for meshes in splitMeshList(static):
+                if len(meshes) == 1:
+                    merged.append(meshes[0])
+                else:
+                    merged.append(concatMeshes(meshes))
+        group[0]["meshes"]= merged + group[0]["meshes"]
+
+# splits a list of mesh data into lists with at most
+# shapewriter.maxSubObjectVertices vertices in all, except for single
+# meshes that are larger by themselves
+def splitMeshList(meshes):
+    lists= [ [] ]
+    nverts= 0
+    for meshData in meshes:
+        n= len(meshData["coords"])
+        if nverts+n > shapewriter.maxSubObjectVertices and lists[-1]:
+            lists.append([])
+            nverts= 0
+        lists[-1].append(meshData)
+        nverts+= n
+    return lists
+
+# returns mesh data that holds all of the given mesh data
+def concatMeshes(meshes):
+    loops= []
+    vi= 0
+    for meshData in meshes:
+        loops.append(meshData["loops"]+vi)
+        vi+= len(meshData["coords"])
+    return { "coords": numpy.concatenate([ m["coords"] for m in meshes ]),
+     "uvs": numpy.concatenate([ m["uvs"] for m in meshes ]),
+     "loops": numpy.concatenate(loops).astype(numpy.int32),
+     "loopTotals": numpy.concatenate([ m["loopTotals"]
+      for m in meshes ]).astype(numpy.int32),
+     "anim": None }
+
+# tolerances used to weld vertices: the largest distance between their
+# positions (meters), texture coordinates and normal vectors
+weldTolerance= (.0001,.0001,.001)
+
+# returns two arrays of vertex indices, the pairs of vertices whose
+# positions are within tolerance of each other
+# the vertices are put in a grid of cells tolerance wide, so only those in
+# the same or neighboring cells need to be compared, and each pair of
+# neighboring cells is only looked at from one side
+def nearVertices(coords,tolerance):
+    cells= numpy.floor(coords/tolerance).astype(numpy.int64)
+    # the rank of each vertex's cell along each axis moved by -1, 0 and 1,
+    # -1 where no vertex is in that row of cells
+    ranks= []
+    for a in range(3):
+        axis= numpy.unique(cells[:,a])
+        r= {}
+        for d in (-1,0,1):
+            v= cells[:,a]+d
+            k= numpy.minimum(numpy.searchsorted(axis,v),len(axis)-1)
+            r[d]= numpy.where(axis[k]==v,k,-1)
+        ranks.append((len(axis),r))
+    # returns the cell number of each vertex's cell moved by offset, or -1
+    def cellNumbers(offset):
+        n= numpy.zeros(len(cells),dtype=numpy.int64)
+        missing= numpy.zeros(len(cells),dtype=bool)
+        for (size,r),d in zip(ranks,offset):
+            missing|= r[d] < 0
+            n= n*size + r[d]
+        n[missing]= -1
+        return n
+    own= cellNumbers((0,0,0))
+    order= numpy.argsort(own,kind="stable")
+    numbers,starts,counts= numpy.unique(own[order],return_index=True,
+     return_counts=True)
+    pairs= []
+    for offset in [ (dx,dy,dz) for dx in (-1,0,1) for dy in (-1,0,1)
+     for dz in (-1,0,1) if (dx,dy,dz) >= (0,0,0) ]:
+        n= cellNumbers(offset)
+        k= numpy.minimum(numpy.searchsorted(numbers,n),len(numbers)-1)
+        count= numpy.where(numbers[k]==n,counts[k],0)
+        i= numpy.repeat(numpy.arange(len(cells)),count)
+        start= numpy.repeat(starts[k]-(numpy.cumsum(count)-count),count)
+        j= order[start+numpy.arange(len(i))]
+        if offset == (0,0,0):
+            keep= i < j
+            i= i[keep]
+            j= j[keep]
+        pairs.append((i,j))
+    i= numpy.concatenate([ p[0] for p in pairs ])
+    j= numpy.concatenate([ p[1] for p in pairs ])
+    near= numpy.linalg.norm(coords[i]-coords[j],axis=1) <= tolerance
+    return i[near],j[near]
+
+# returns mesh data with the vertices whose position, texture coordinates
+# and normal are within weldTolerance of each other, directly or through
+# other such vertices, made into one vertex
+# faces left with the same vertex twice in a row lose the repeat and
+# faces with fewer than three vertices are removed
+def weldMesh(meshData):
+    coords= meshData["coords"]
+    uvs= meshData["uvs"]
+    loops= meshData["loops"]
+    totals= meshData["loopTotals"]
+    if len(coords) == 0:
+        return meshData
+    tc,tu,tn= weldTolerance
+    i,j= nearVertices(coords,tc)
+    if len(i) > 0:
+        normals= shapewriter.vertexNormals(coords,
+         shapewriter.triangulate(loops,totals))
+        near= (numpy.linalg.norm(uvs[i]-uvs[j],axis=1) <= tu) & \
+         (numpy.linalg.norm(normals[i]-normals[j],axis=1) <= tn)
+        i= i[near]
+        j= j[near]
+    if len(i) == 0:
+        return meshData
+    # each vertex takes the lowest index of the vertices it is joined to
+    label= numpy.arange(len(coords))
+    while True:
+        old= label.copy()
+        numpy.minimum.at(label,j,label[i])
+        numpy.minimum.at(label,i,label[j])
+        label= label[label]
+        if numpy.array_equal(label,old):
+            break
+    first,index= numpy.unique(label,return_inverse=True)
+    index= index.ravel()
+    loops= index[loops]
+    starts= numpy.cumsum(totals)-totals
+    face= numpy.repeat(numpy.arange(len(totals)),totals)
+    pos= numpy.arange(len(loops))
+    nxt= starts[face] + (pos-starts[face]+1)%totals[face]
+    keep= loops != loops[nxt]
+    totals= totals - numpy.bincount(face,weights=~keep,
+     minlength=len(totals)).astype(totals.dtype)
+    keep&= totals[face] >= 3
+    totals= totals[totals>=3]
+    return { "coords": coords[first], "uvs": uvs[first],
+     "loops": loops[keep].astype(numpy.int32),
+     "loopTotals": totals.astype(numpy.int32), "anim": meshData["anim"] }
+
+# welds the vertices of each LOD mesh, keeping meshes shared by several
+# LODs shared
+def weldMeshes(lods):
+    welded= {}
+    for lod in lods:
+        for i in range(len(lod["meshes"])):
+            meshData= lod["meshes"][i]
+            if id(meshData) not in welded:
+                welded[id(meshData)]= weldMesh(meshData)
+            lod["meshes"][i]= welded[id(meshData)]
+
+# makes the center lines of already sorted paths again with another
+# chord tolerance
+def remakeCenterLines(paths,tunnel,tolerance):
+    for path in paths:
+        getCenterLine(path,tolerance)
+        if "reversed" in path:
+            flipCenterLine(path["centerLine"])
+    if tunnel and not any(tunnel["path"] is path for path in paths):
+        getCenterLine(tunnel["path"],tolerance)
+
+# splits a center line into equal pieces of about length meters
+# returns a list of the pieces with the distance along the center line
+# where each one starts, neighboring pieces share a point
+def centerLineChunks(centerLine,length):
+    total= 0
+    for i in range(len(centerLine)-1):
+        total+= (centerLine[i+1]["point"]-centerLine[i]["point"]).length
+    length= total/max(1,round(total/length))
+    chunks= []
+    cl= [ centerLine[0] ]
+    start= 0
+    dist= 0
+    for i in range(len(centerLine)-1):
+        p1= centerLine[i]["point"]
+        p2= centerLine[i+1]["point"]
+        perp1= centerLine[i]["perp"]
+        perp2= centerLine[i+1]["perp"]
+        d= (p2-p1).length
+        while dist+d > start+length+.01:
+            x= (start+length-dist)/d
+            cp= { "point":p1.lerp(p2,x), "perp":perp1.lerp(perp2,x) }
+            cl.append(cp)
+            chunks.append({ "centerLine":cl, "dist":start })
+            cl= [ cp ]
+            start+= length
+        cl.append(centerLine[i+1])
+        dist+= d
+    chunks.append({ "centerLine":cl, "dist":start })
+    return chunks
+
+# drops the arrays cached for a center line that is not used again
+# the center line itself is kept so its id is not reused
+def releaseCenterLine(centerLine):
+    keys= ("keys",id(centerLine))
+    if keys not in meshCache:
+        return
+    for key in meshCache[keys][1]:
+        meshCache[key]= meshCache[key][:1]
+    meshCache[keys]= (centerLine,[])
+
+# makes the mesh data for each LOD of a plain track shape in pieces of
+# chunkLength meters along each path, one piece at a time for all LODs
+# so only one piece's arrays are kept in meshCache
+# each piece is tagged with the index of its path and its own index so
+# mergeMeshes keeps it apart, the ends are left untagged
+def makeChunkedMeshes(shape,profile,lods,paths,tunnel,ends):
+    length= shape["chunkLength"]
+    parts= [ None ]
+    if "parts" in profile:
+        parts= [ "rightrail", "leftrail", "ballast", "ties" ]
+    lines= [ (path["centerLine"],parts) for path in paths ]
+    if tunnel and "parts" in profile:
+        lines.append((tunnel["path"]["centerLine"],[ tunnel["part"] ]))
+    for j in range(len(lines)):
+        centerLine,lineParts= lines[j]
+        chunks= centerLineChunks(centerLine,length)
+        for i in range(len(chunks)):
+            cl= chunks[i]["centerLine"]
+            for lod in lods:
+                for part in lineParts:
+                    makeMesh(lod,shape,part,cl,0,None,chunks[i]["dist"],
+                     (j,i))
+            releaseCenterLine(cl)
+        if ends and "parts" in profile and lineParts is parts:
+            for lod in lods:
+                makeMesh(lod,shape,"end",centerLine,0,None)
+
+# makes the mesh data for each LOD of a track shape
+def makeMeshes(shape,profile,lods,paths,partLines,tunnel,ends):
+    if not partLines and "chunkLength" in shape:
+        for lod in lods:
+            lod["meshes"]= []
+        makeChunkedMeshes(shape,profile,lods,paths,tunnel,ends)
+        return
+    for lod in lods:
+        lod["meshes"]= []
         if partLines:
             for pl in partLines:
                 anim= None
@@ -693,6 +1516,13 @@ def makeTrack(shape,profile,collection):
             for path in paths:
                 cl= path["centerLine"]
                 makeMesh(lod,shape,None,cl,0,None)
+
+# makes blender objects and MAIN_nnnn collections for the mesh data
+def makeObjects(lods,cutoffs,collection):
+    for lod in lods:
+        lod["objects"]= []
+        for meshData in lod["meshes"]:
+            makeObject(lod,meshData)
     for d in cutoffs:
         cname= "MAIN_%4.4d"%(d)
         col= bpy.data.collections.new(cname)
@@ -703,6 +1533,66 @@ def makeTrack(shape,profile,collection):
                 for obj in objects:
                     col.objects.link(obj)
 
+# switch stand models read from .blend files, keyed by file name
+# each holds the names of the objects in the file's switchstand
+# collection, which are kept out of the scene and copied for each shape
+switchStands= {}
+
+# marks a data block as part of a switch stand model so resetScene
+# keeps it
+def markSwitchStand(data):
+    if data is not None:
+        data["switchStandModel"]= True
+
+# returns the objects of the switch stand model in a .blend file
+# the file is only read the first time, or again after the session has
+# been cleared by opening another file
+def loadSwitchStand(filename):
+    key= os.path.abspath(filename)
+    names= switchStands.get(key)
+    if names and all(name in bpy.data.objects for name in names):
+        return [ bpy.data.objects[name] for name in names ]
+    with bpy.data.libraries.load(filename) as (dataFrom,dataTo):
+        dataTo.collections= [ "switchstand" ]
+    sscol= dataTo.collections[0]
+    models= list(sscol.objects)
+    bpy.data.collections.remove(sscol)
+    for obj in models:
+        obj["switchStandName"]= obj.name
+        obj.name= obj.name+" model"
+        obj.use_fake_user= True
+        markSwitchStand(obj)
+        markSwitchStand(obj.data)
+        if obj.animation_data:
+            markSwitchStand(obj.animation_data.action)
+        for slot in obj.material_slots:
+            markSwitchStand(slot.material)
+    switchStands[key]= [ obj.name for obj in models ]
+    return models
+
+# returns copies of switch stand model objects with their own names,
+# parents and animation, sharing the model's meshes and materials
+def copySwitchStand(models):
+    copies= {}
+    for model in models:
+        obj= model.copy()
+        del obj["switchStandName"]
+        del obj["switchStandModel"]
+        obj.use_fake_user= False
+        obj.name= model["switchStandName"]
+        if obj.animation_data and obj.animation_data.action:
+            action= obj.animation_data.action.copy()
+            del action["switchStandModel"]
+            obj.animation_data.action= action
+        copies[model.name]= obj
+    for model in models:
+        if model.parent and model.parent.name in copies:
+            copies[model.name].parent= copies[model.parent.name]
+    return { model["switchStandName"]: copies[model.name]
+     for model in models }
+
+# places and animates a copy of the shape's switch stand model
+# returns the switch stand objects or None
 def initSwitchStand(shape,shapefile):
     if "switchstand" in shape:
         switchstand= shape["switchstand"]
@@ -710,15 +1600,15 @@ def initSwitchStand(shape,shapefile):
         if not os.path.exists(filename):
             filename= os.path.join(os.path.dirname(shapefile),filename)
         if os.path.exists(filename):
-            bpy.ops.wm.open_mainfile(filepath=filename)
+            stand= copySwitchStand(loadSwitchStand(filename))
         else:
             print("cannot find %s"%(filename))
-            return
-        obj= bpy.data.objects["switchstand"]
+            return None
+        obj= stand["switchstand"]
         obj.location= switchstand["position"]
         obj.rotation_euler= 0, 0, switchstand["rotation"]*math.pi/180
         if "derail" in shape:
-            redtarget= bpy.data.objects["redtarget"]
+            redtarget= stand["redtarget"]
             redtarget.rotation_euler= 0,0,math.pi/2
             redtarget.keyframe_insert("rotation_euler",frame=0)
             redtarget.rotation_euler= 0,0,0
@@ -726,64 +1616,188 @@ def initSwitchStand(shape,shapefile):
             redtarget.rotation_euler= 0,0,math.pi/2
         if "crankRotation" in switchstand:
             rot= switchstand["crankRotation"]*math.pi/180
-            crank= bpy.data.objects["crank"]
+            crank= stand["crank"]
             crank.rotation_euler= 0,0,math.pi*5/4+rot
             crank.keyframe_insert("rotation_euler",frame=0)
             crank.rotation_euler= 0,0,math.pi*3/4+rot
             crank.keyframe_insert("rotation_euler",frame=1)
             crank.rotation_euler= 0,0,math.pi*5/4+rot
+        return list(stand.values())
+    return None
 
+# the switch stand is added to every MAIN_nnnn collection made by makeTrack
 def makeCollections(shape,profile,filename):
-    initSwitchStand(shape,filename)
+    with buildreport.stage("initSwitchStand"):
+        stand= initSwitchStand(shape,filename)
     maincol= bpy.data.collections.new("MAIN")
     bpy.context.scene.collection.children.link(maincol)
     makeTrack(shape,profile,maincol)
-    if "switchstand" in bpy.data.collections:
-        sscol= bpy.data.collections["switchstand"]
-        for obj in sscol.objects:
-            bpy.data.collections["MAIN_2000"].objects.link(obj)
-            bpy.data.collections["MAIN_0700"].objects.link(obj)
-            bpy.data.collections["MAIN_1000"].objects.link(obj)
-            bpy.data.collections["MAIN_1200"].objects.link(obj)
-
-class ShapeFileSelector(bpy.types.Operator):
-    bl_idname= "ui.selecttrackshape"
-    bl_description= "Select Track Shape JSON file"
-    bl_label= "Load Shape"
-    filepath: bpy.props.StringProperty(subtype="FILE_PATH")
-    filter_glob: bpy.props.StringProperty(default="*.json",options={'HIDDEN'})
-    def execute(self,context):
-        shape= readjson(self.filepath)
-        makeCollections(shape,profile,self.filepath)
-        return {'FINISHED'}
-    def invoke(self,context,event):
-        context.window_manager.fileselect_add(self)
-        return {'RUNNING_MODAL'}
-
-class ProfileFileSelector(bpy.types.Operator):
-    bl_idname= "ui.selecttrackprofile"
-    bl_description= "Select Track Profile JSON file"
-    bl_label= "Load Profile"
-    filepath: bpy.props.StringProperty(subtype="FILE_PATH")
-    filter_glob: bpy.props.StringProperty(default="*.json",options={'HIDDEN'})
-    def execute(self,context):
-        global profile
-        profile= readjson(self.filepath)
-        bpy.ops.ui.selecttrackshape('INVOKE_DEFAULT')
-        return {'FINISHED'}
-    def invoke(self,context,event):
-        context.window_manager.fileselect_add(self)
-        return {'RUNNING_MODAL'}
-
-bpy.utils.register_class(ShapeFileSelector)
-bpy.utils.register_class(ProfileFileSelector)
-
-if "--" in sys.argv:
-    args= sys.argv[sys.argv.index("--")+1:]
-    shape= readjson(args[0])
-    profile= readjson(args[1])
-    makeCollections(shape,profile,args[0])
-    bpy.ops.export.msts_s(filepath=shape["filename"])
-#    bpy.ops.wm.save_as_mainfile(filepath=shape["filename"]+".blend")
-else:
-    bpy.ops.ui.selecttrackprofile('INVOKE_DEFAULT')
+    if stand:
+        for col in maincol.children:
+            for obj in stand:
+                col.objects.link(obj)
+
+# writes a track shape made without blender
+def writeTrack(shape,profile,compress=False):
+    parts= []
+    for lod in profile["LODs"]:
+        parts.append({ "cutoff": lod["CutoffRadius"],
+         "material": lodMaterial(lod), "meshes": lod["meshes"] })
+    shapewriter.writeShape(shape["filename"],parts,compress)
+
+if bpy:
+    class ShapeFileSelector(bpy.types.Operator):
+        bl_idname= "ui.selecttrackshape"
+        bl_description= "Select Track Shape JSON file"
+        bl_label= "Load Shape"
+        filepath: bpy.props.StringProperty(subtype="FILE_PATH")
+        filter_glob: bpy.props.StringProperty(default="*.json",options={'HIDDEN'})
+        def execute(self,context):
+            shape= readShape(self.filepath)
+            makeCollections(shape,profile,self.filepath)
+            return {'FINISHED'}
+        def invoke(self,context,event):
+            context.window_manager.fileselect_add(self)
+            return {'RUNNING_MODAL'}
+
+    class ProfileFileSelector(bpy.types.Operator):
+        bl_idname= "ui.selecttrackprofile"
+        bl_description= "Select Track Profile JSON file"
+        bl_label= "Load Profile"
+        filepath: bpy.props.StringProperty(subtype="FILE_PATH")
+        filter_glob: bpy.props.StringProperty(default="*.json",options={'HIDDEN'})
+        def execute(self,context):
+            global profile
+            profile= trackprofile.loadProfile(self.filepath)
+            bpy.ops.ui.selecttrackshape('INVOKE_DEFAULT')
+            return {'FINISHED'}
+        def invoke(self,context,event):
+            context.window_manager.fileselect_add(self)
+            return {'RUNNING_MODAL'}
+
+    bpy.utils.register_class(ShapeFileSelector)
+    bpy.utils.register_class(ProfileFileSelector)
+
+    frameEnd= bpy.context.scene.frame_end
+
+# removes the objects, meshes, materials, actions and collections made
+# for the previous shape so that another shape can be made in this session
+# the track materials from poolMaterial and the switch stand models from
+# loadSwitchStand are kept for the next shape
+def resetScene():
+    for col in list(bpy.data.collections):
+        bpy.data.collections.remove(col)
+    for obj in list(bpy.data.objects):
+        if "switchStandModel" not in obj:
+            bpy.data.objects.remove(obj)
+    for mesh in list(bpy.data.meshes):
+        if "switchStandModel" not in mesh:
+            bpy.data.meshes.remove(mesh)
+    for mat in list(bpy.data.materials):
+        if "trackMaterial" not in mat and "switchStandModel" not in mat:
+            bpy.data.materials.remove(mat)
+    for action in list(bpy.data.actions):
+        if "switchStandModel" not in action:
+            bpy.data.actions.remove(action)
+    bpy.context.scene.frame_end= frameEnd
+
+# reads a manifest file that maps shape file names to profile file names
+# returns a list of (shape file, profile file) pairs
+def readManifest(filename):
+    manifest= readjson(filename)
+    return list(manifest.items())
+
+# reads a shape file
+# a shape with mirror, the name of another shape file, gets that shape's
+# paths and switch settings reflected left to right
+def readShape(shapefile):
+    shape= readjson(shapefile)
+    if "mirror" in shape:
+        filename= shape["mirror"]
+        if not os.path.exists(filename):
+            filename= os.path.join(os.path.dirname(shapefile),filename)
+        for k in geometryFields:
+            shape.pop(k,None)
+        shape.update(mirrorGeometry(readShape(filename)))
+    return shape
+
+# makes and exports a track shape for each (shape file, profile file) pair
+# each profile file is only read once, see trackprofile.py
+# without blender the shapes are written by shapewriter
+# the .s files are compressed if compress is true
+# returns a list of the shape files that could not be made
+def makeShapes(jobs,compress=False):
+    global profile
+    madeTracks.clear()
+    profiles= {}
+    failed= []
+    for i in range(len(jobs)):
+        shapefile,profilefile= jobs[i]
+        buildreport.item(shapefile)
+        if i>0 and bpy:
+            with buildreport.stage("resetScene"):
+                resetScene()
+        try:
+            if profilefile not in profiles:
+                with buildreport.stage("loadProfile"):
+                    profiles[profilefile]= \
+                     trackprofile.loadProfile(profilefile)
+            profile= profiles[profilefile]
+            shape= readShape(shapefile)
+            if bpy:
+                makeCollections(shape,profile,shapefile)
+                with buildreport.stage("export"):
+                    bpy.ops.export.msts_s(filepath=shape["filename"])
+                if compress:
+                    with buildreport.stage("compress"):
+                        shapewriter.compressShapeFile(shape["filename"])
+#                bpy.ops.wm.save_as_mainfile(filepath=shape["filename"]+".blend")
+            elif "switchstand" in shape:
+                raise Exception("switch stand requires blender")
+            else:
+                makeTrack(shape,profile,None)
+                with buildreport.stage("export"):
+                    writeTrack(shape,profile,compress)
+            buildreport.output(shape["filename"])
+        except Exception:
+            traceback.print_exc()
+            print("cannot make %s"%(shapefile))
+            buildreport.failed()
+            failed.append(shapefile)
+    return failed
+
+# returns the (shape file, profile file) pairs named by the arguments
+# after -- and whether --compress was given
+def parseArgs(args):
+    compress= False
+    if args[0] == "--compress":
+        compress= True
+        args= args[1:]
+    if args[0] == "--manifest":
+        jobs= readManifest(args[1])
+    else:
+        jobs= [ (shapefile,args[-1]) for shapefile in args[:-1] ]
+    return jobs,compress
+
+# makes the shapes named on the command line
+# trackshape.py can also be imported, see benchmark.py
+def main():
+    args= None
+    if "--" in sys.argv:
+        args= sys.argv[sys.argv.index("--")+1:]
+    elif not bpy:
+        args= sys.argv[1:]
+    args= buildreport.enable("trackshape.py",args)
+    if args:
+        jobs,compress= parseArgs(args)
+        failed= makeShapes(jobs,compress)
+        if failed:
+            print("%d of %d shapes failed"%(len(failed),len(jobs)))
+            sys.exit(1)
+    elif bpy:
+        bpy.ops.ui.selecttrackprofile('INVOKE_DEFAULT')
+    else:
+        print("usage: python3 trackshape.py shape.json... profile.json")
+
+if __name__ == "__main__":
+    main()